@@ -0,0 +1,3 @@
+from madlibs.cli import main
+
+main()
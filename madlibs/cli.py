@@ -0,0 +1,87 @@
+import argparse
+import json
+import sys
+from typing import List, Optional, TextIO
+
+from madlibs.utils import make_madlibs
+
+
+def make_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog="madlibs",
+        description="Generate text from templates and fillers as JSON lines",
+    )
+    parser.add_argument("fillers", help="The JSON file with the fillers")
+    parser.add_argument("templates", help="The JSON file with the template groups")
+    parser.add_argument(
+        "--group",
+        action="append",
+        help="A template group to generate. Can be repeated. Defaults to all groups.",
+    )
+    parser.add_argument("--output", help="The output file. Defaults to stdout.")
+    parser.add_argument(
+        "--cache-dir", help="A directory in which to keep the built template groups"
+    )
+    parser.add_argument(
+        "--method", choices=["backtrack", "matrix"], default="backtrack"
+    )
+    parser.add_argument(
+        "--order", choices=["sequential", "shuffled"], default="sequential"
+    )
+    parser.add_argument("--seed", type=int, help="The seed for the shuffled order")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument(
+        "--shard",
+        type=int,
+        default=0,
+        help="The shard of every group to generate, counting from 0",
+    )
+    parser.add_argument("--num-shards", type=int, default=1)
+    parser.add_argument(
+        "--dedup",
+        choices=["memory", "disk", "bloom"],
+        help="Drop items whose texts repeat an earlier item of the same group",
+    )
+    parser.add_argument(
+        "--dedup-error-rate",
+        type=float,
+        help="The probability that the bloom store drops an item that is not repeated",
+    )
+    parser.add_argument(
+        "--dedup-capacity",
+        type=int,
+        help="The number of items the bloom store is sized for. Defaults to a count.",
+    )
+    return parser
+
+
+def write_items(args: argparse.Namespace, out: TextIO) -> None:
+    data = make_madlibs(args.fillers, args.templates, args.cache_dir)
+    groups = args.group if args.group is not None else list(data)
+    for group in groups:
+        if group not in data:
+            raise Exception(f"Unknown template group {group}")
+
+        items = data[group].generate(
+            method=args.method,
+            order=args.order,
+            seed=args.seed,
+            workers=args.workers,
+            shard=args.shard,
+            num_shards=args.num_shards,
+            dedup=args.dedup,
+            dedup_error_rate=args.dedup_error_rate,
+            dedup_capacity=args.dedup_capacity,
+        )
+        for params, generated in items:
+            item = {"group": group, "params": params, "generated": generated}
+            out.write(json.dumps(item) + "\n")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = make_parser().parse_args(argv)
+    if args.output is None:
+        write_items(args, sys.stdout)
+    else:
+        with open(args.output, "w") as out:
+            write_items(args, out)
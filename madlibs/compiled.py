@@ -0,0 +1,208 @@
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import jinja2.nodes as jnodes
+from jinja2 import Environment, Template
+from markupsafe import escape
+
+from madlibs.constraints import register_known_constraints
+from madlibs.core import known_constraints, known_domains
+from madlibs.domains import register_known_domains
+
+# A filter call, with the arguments that follow the value
+FilterCall = Tuple[Callable[..., Any], List[Any], Dict[str, Any]]
+
+
+class CompiledTemplate:
+    """A compiled template renders a template that only prints variables, possibly
+    through filters, without going through Jinja.
+
+    The text between the variables is kept as literal segments. Each variable is a
+    slot with the filters to apply to its value, which are the functions Jinja
+    itself would call. Rendering fills the slots, escaping the values if the
+    environment autoescapes, and joins the segments.
+    """
+
+    segments: List[str]
+    slots: List[Tuple[int, str, List[FilterCall]]]
+    finalize: Callable[[Any], str]
+
+    def __init__(
+        self,
+        segments: List[str],
+        slots: List[Tuple[int, str, List[FilterCall]]],
+        finalize: Callable[[Any], str],
+    ) -> None:
+        self.segments = segments
+        self.slots = slots
+        self.finalize = finalize
+
+    def render(self, fillers: Dict[str, str]) -> str:
+        parts = list(self.segments)
+        for position, name, filters in self.slots:
+            value: Any = fillers[name]
+            for f, args, kwargs in filters:
+                value = f(value, *args, **kwargs)
+            parts[position] = self.finalize(value)
+        return "".join(parts)
+
+
+def needs_jinja(f: Callable[..., Any]) -> bool:
+    """Check whether a filter needs the Jinja context, evaluation context or
+    environment, which only Jinja can pass to it
+
+    Args:
+        f (Callable[..., Any]): The filter
+
+    Returns:
+        bool: True if the filter has to be called by Jinja
+    """
+    # Jinja 3 marks these filters with a single attribute, and Jinja 2 with one
+    # attribute for each kind
+    if getattr(f, "jinja_pass_arg", None) is not None:
+        return True
+    flags = ["contextfilter", "evalcontextfilter", "environmentfilter"]
+    return any(getattr(f, flag, False) for flag in flags)
+
+
+def compile_filters(
+    env: Environment, node: jnodes.Node
+) -> Optional[Tuple[str, List[FilterCall]]]:
+    """Compile a chain of filters applied to a variable
+
+    Args:
+        env (Environment): The environment that defines the filters
+        node (jnodes.Node): A Name node, or a Filter node over one
+
+    Returns:
+        Optional[Tuple[str, List[FilterCall]]]: The name of the variable, and the
+        filters to apply to it in order, or None if the chain can not be compiled
+    """
+    calls: List[FilterCall] = []
+    while isinstance(node, jnodes.Filter):
+        name = node.name  # type: ignore
+        if node.dyn_args is not None or node.dyn_kwargs is not None:  # type: ignore
+            return None
+        args = node.args  # type: ignore
+        kwargs = node.kwargs  # type: ignore
+        if not all(isinstance(a, jnodes.Const) for a in args):
+            return None
+        if not all(isinstance(k.value, jnodes.Const) for k in kwargs):
+            return None
+
+        # Domains and constraints print their variable unchanged
+        if name not in known_domains and name not in known_constraints:
+            f = env.filters.get(name)
+            if f is None or needs_jinja(f):
+                return None
+            values = [a.value for a in args]  # type: ignore
+            keywords: Dict[str, Any] = {
+                k.key: k.value.value for k in kwargs  # type: ignore
+            }
+            calls.append((f, values, keywords))
+        node = node.node  # type: ignore
+
+    if not isinstance(node, jnodes.Name):
+        return None
+
+    # The filters wrap each other, so the innermost one is applied first
+    calls.reverse()
+    return node.name, calls  # type: ignore
+
+
+def compile_template(
+    env: Environment, ast: jnodes.Template
+) -> Optional[CompiledTemplate]:
+    """Compile a parsed template into literal segments and variable slots
+
+    Args:
+        env (Environment): The environment the template was parsed with
+        ast (jnodes.Template): The parsed template
+
+    Returns:
+        Optional[CompiledTemplate]: The compiled template, or None if the template
+        uses anything that needs Jinja to render it
+    """
+    if env.autoescape is True:
+        finalize: Callable[[Any], str] = escape
+    elif env.autoescape is False:
+        finalize = str
+    else:
+        return None
+
+    body = ast.body  # type: ignore
+    if len(body) != 1 or not isinstance(body[0], jnodes.Output):
+        return None
+
+    segments: List[str] = []
+    slots: List[Tuple[int, str, List[FilterCall]]] = []
+    literal: List[str] = []
+    for node in body[0].nodes:  # type: ignore
+        if isinstance(node, jnodes.TemplateData):
+            literal.append(node.data)  # type: ignore
+            continue
+
+        compiled = compile_filters(env, node)
+        if compiled is None:
+            return None
+        if len(literal) > 0:
+            segments.append("".join(literal))
+            literal = []
+        slots.append((len(segments), compiled[0], compiled[1]))
+        segments.append("")
+
+    if len(literal) > 0:
+        segments.append("".join(literal))
+    return CompiledTemplate(segments, slots, finalize)
+
+
+def make_environment() -> Environment:
+    """Make a Jinja environment that knows the domain and constraint filters
+
+    Returns:
+        Environment: The new environment
+    """
+    env = Environment(autoescape=True)
+    register_known_domains(env)
+    register_known_constraints(env)
+    return env
+
+
+class TemplateCache:
+    """A template cache parses and compiles the sources of templates in a shared
+    environment, once per distinct source. The Jinja template is only compiled if
+    it is asked for, since most templates are rendered without Jinja.
+    """
+
+    env: Environment
+    asts: Dict[str, jnodes.Template]
+    compiled: Dict[str, Optional[CompiledTemplate]]
+    templates: Dict[str, Template]
+
+    def __init__(self, env: Optional[Environment] = None) -> None:
+        """Make an empty cache
+
+        Args:
+            env (Optional[Environment], optional): The environment to use. It has to
+                                                   know the domain and constraint
+                                                   filters. Defaults to None, for a
+                                                   new environment.
+        """
+        self.env = make_environment() if env is None else env
+        self.asts = {}
+        self.compiled = {}
+        self.templates = {}
+
+    def parse(self, source: str) -> jnodes.Template:
+        if source not in self.asts:
+            self.asts[source] = self.env.parse(source)
+        return self.asts[source]
+
+    def compile(self, source: str) -> Optional[CompiledTemplate]:
+        if source not in self.compiled:
+            self.compiled[source] = compile_template(self.env, self.parse(source))
+        return self.compiled[source]
+
+    def jinja_template(self, source: str) -> Template:
+        if source not in self.templates:
+            self.templates[source] = self.env.from_string(self.parse(source))
+        return self.templates[source]
@@ -1,11 +1,101 @@
 import abc
-from typing import Any, Dict, Optional
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple, Union
 
+import numpy as np
 from jinja2 import Environment
 
 from madlibs.core import known_constraints
 
 
+def parse_numbers(values: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+    """Parse a list of fillers as numbers, the way the constraints do
+
+    Args:
+        values (List[str]): The fillers
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: The parsed numbers, and a mask of the fillers
+        that are numeric. Fillers that are not numeric are parsed as NaN.
+    """
+    numbers = np.full(len(values), np.nan)
+    numeric = np.zeros(len(values), dtype=bool)
+    for i, v in enumerate(values):
+        try:
+            numbers[i] = float(v)
+            numeric[i] = True
+        except Exception:
+            pass
+    return numbers, numeric
+
+
+def equality_matrix(values: List[str], others: List[str]) -> np.ndarray:
+    # Numeric fillers are compared as numbers, and everything else as strings
+    numbers, numeric = parse_numbers(values)
+    other_numbers, other_numeric = parse_numbers(others)
+
+    codes: Dict[str, int] = {}
+    value_codes = np.array([codes.setdefault(v, len(codes)) for v in values])
+    other_codes = np.array([codes.setdefault(v, len(codes)) for v in others])
+
+    return np.where(
+        np.logical_and.outer(numeric, other_numeric),
+        np.equal.outer(numbers, other_numbers),
+        np.equal.outer(value_codes, other_codes),
+    )
+
+
+def filler_key(value: str) -> Union[float, str]:
+    """Find the value that a filler is compared by in the equals and not_equals
+    constraints
+
+    Args:
+        value (str): The filler
+
+    Returns:
+        Union[float, str]: The number for numeric fillers, and the filler itself for
+        other fillers
+    """
+    try:
+        return float(value)
+    except Exception:
+        return value
+
+
+def equality_key(value: str) -> Optional[Hashable]:
+    """Find a key for a filler such that two fillers are equal under the equals
+    constraint exactly when their keys are equal
+
+    Args:
+        value (str): The filler
+
+    Returns:
+        Optional[Hashable]: The number for numeric fillers, the filler itself for
+        other fillers, or None for fillers that are not equal to anything
+    """
+    key = filler_key(value)
+    # NaN is not equal to anything, not even itself
+    if key != key:
+        return None
+    return key
+
+
+class FillerNumbers(Dict[str, float]):
+    """The numbers of fillers, parsed in advance. Fillers that were not parsed in
+    advance are parsed when they are looked up."""
+
+    def __missing__(self, value: str) -> float:
+        return float(value)
+
+
+class FillerKeys(Dict[str, Union[float, str]]):
+    """The keys of fillers for the equals and not_equals constraints, found in
+    advance. Fillers that were not seen in advance get their key when they are
+    looked up."""
+
+    def __missing__(self, value: str) -> Union[float, str]:
+        return filler_key(value)
+
+
 def register_known_constraints(env: Environment) -> None:
     def dummy_processor(x: Any, *args: Any) -> str:
         return x
@@ -22,6 +112,14 @@ class Constraint(abc.ABC):
         self.constraint_name = constraint_name
         self.variable_name = variable_name
 
+    def variables(self) -> List[str]:
+        """The variables whose values this constraint reads
+
+        Returns:
+            List[str]: The names of the variables
+        """
+        return [self.variable_name]
+
     @abc.abstractmethod
     def check(self, fillers: Dict[str, str]) -> bool:
         """Check if this constraint holds for the given fillers
@@ -34,56 +132,120 @@ class Constraint(abc.ABC):
         """
 
 
-class EqualityConstraint(Constraint):
-    def __init__(self, variable_name: str, other_name: str) -> None:
-        super().__init__("equals", variable_name)
+class BinaryConstraint(Constraint):
+    """A binary constraint compares the fillers of two variables. The fillers are
+    parsed first, into numbers for ordered comparisons and into their keys for
+    equality. Until the constraint is specialized to the domains of its variables,
+    the fillers are parsed on every check."""
+
+    other_name: str
+    numeric: bool = False
+    parse: Callable[[str], Any]
+    other_parse: Callable[[str], Any]
+
+    def __init__(
+        self, constraint_name: str, variable_name: str, other_name: str
+    ) -> None:
+        super().__init__(constraint_name, variable_name)
         self.other_name = other_name
+        self.parse = float if self.numeric else filler_key
+        self.other_parse = self.parse
+
+    def variables(self) -> List[str]:
+        return [self.variable_name, self.other_name]
+
+    def specialize(
+        self,
+        numbers: Dict[str, Callable[[str], float]],
+        keys: Dict[str, Callable[[str], Any]],
+    ) -> None:
+        """Compare the fillers of the variables through the values that their
+        domains parsed in advance, for the variables whose domains have them
+
+        Args:
+            numbers (Dict[str, Callable[[str], float]]): For each variable whose
+                fillers are all numbers, a function that finds the number of a filler
+            keys (Dict[str, Callable[[str], Any]]): For each variable, a function
+                that finds the key of a filler, like filler_key
+        """
+        parsers = numbers if self.numeric else keys
+        self.parse = parsers.get(self.variable_name, self.parse)
+        self.other_parse = parsers.get(self.other_name, self.other_parse)
+
+    def matrix(self, values: List[str], others: List[str]) -> np.ndarray:
+        """Evaluate this constraint over all pairs of fillers at once
+
+        Args:
+            values (List[str]): The fillers for the variable
+            others (List[str]): The fillers for the other variable
+
+        Returns:
+            np.ndarray: A boolean matrix of shape (len(values), len(others)) whose
+            entry i, j is True if the constraint holds for values[i] and others[j]
+        """
+        output = np.zeros((len(values), len(others)), dtype=bool)
+        for i, a in enumerate(values):
+            for j, b in enumerate(others):
+                filler = {self.variable_name: a, self.other_name: b}
+                output[i, j] = self.check(filler)
+        return output
+
+
+class EqualityConstraint(BinaryConstraint):
+    def __init__(self, variable_name: str, other_name: str) -> None:
+        super().__init__("equals", variable_name, other_name)
 
     def check(self, filler: Dict[str, str]) -> bool:
-        a = filler[self.variable_name]
-        b = filler[self.other_name]
-        # a dirty hack to ensure that numeric equality is checked
-        try:
-            return float(a) == float(b)
-        except Exception:
-            return a == b
+        # Numeric fillers are compared as numbers, and everything else as strings
+        a = self.parse(filler[self.variable_name])
+        return a == self.other_parse(filler[self.other_name])
+
+    def matrix(self, values: List[str], others: List[str]) -> np.ndarray:
+        return equality_matrix(values, others)
 
 
-class InequalityConstraint(Constraint):
+class InequalityConstraint(BinaryConstraint):
     def __init__(self, variable_name: str, other_name: str) -> None:
-        super().__init__("not_equals", variable_name)
-        self.other_name = other_name
+        super().__init__("not_equals", variable_name, other_name)
 
     def check(self, filler: Dict[str, str]) -> bool:
-        a = filler[self.variable_name]
-        b = filler[self.other_name]
-        # a dirty hack to ensure that numeric equality is checked
-        try:
-            return float(a) != float(b)
-        except Exception:
-            return a != b
+        a = self.parse(filler[self.variable_name])
+        return a != self.other_parse(filler[self.other_name])
 
+    def matrix(self, values: List[str], others: List[str]) -> np.ndarray:
+        return np.logical_not(equality_matrix(values, others))
+
+
+class LessThanConstraint(BinaryConstraint):
+    numeric = True
 
-class LessThanConstraint(Constraint):
     def __init__(self, variable_name: str, other_name: str) -> None:
-        super().__init__("less_than", variable_name)
-        self.other_name = other_name
+        super().__init__("less_than", variable_name, other_name)
 
     def check(self, filler: Dict[str, str]) -> bool:
-        a = filler[self.variable_name]
-        b = filler[self.other_name]
-        return float(a) < float(b)
+        a = self.parse(filler[self.variable_name])
+        return a < self.other_parse(filler[self.other_name])
+
+    def matrix(self, values: List[str], others: List[str]) -> np.ndarray:
+        a = np.array([float(v) for v in values])
+        b = np.array([float(v) for v in others])
+        return np.less.outer(a, b)
 
 
-class GreaterThanConstraint(Constraint):
+class GreaterThanConstraint(BinaryConstraint):
+    numeric = True
+
     def __init__(self, variable_name: str, other_name: str) -> None:
-        super().__init__("greater_than", variable_name)
-        self.other_name = other_name
+        super().__init__("greater_than", variable_name, other_name)
 
     def check(self, filler: Dict[str, str]) -> bool:
-        a = filler[self.variable_name]
-        b = filler[self.other_name]
-        return float(a) > float(b)
+        a = self.parse(filler[self.variable_name])
+        return a > self.other_parse(filler[self.other_name])
+
+    def matrix(self, values: List[str], others: List[str]) -> np.ndarray:
+        a = np.array([float(v) for v in values])
+        b = np.array([float(v) for v in others])
+        return np.greater.outer(a, b)
 
 
 binary_constraints = {
@@ -0,0 +1,406 @@
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from madlibs.constraints import (
+    BinaryConstraint,
+    Constraint,
+    EqualityConstraint,
+    GreaterThanConstraint,
+    InequalityConstraint,
+    LessThanConstraint,
+    equality_key,
+)
+from madlibs.join import (
+    allowed_values,
+    constraint_levels,
+    extend_rows,
+    pair_matrix,
+)
+from madlibs.search import AssignmentSearch
+
+
+def count_assignments(search: AssignmentSearch, batch_size: int = 1 << 16) -> int:
+    """Count the assignments that satisfy the constraints of a search without
+    enumerating them one by one
+
+    The independent variables are grouped into connected components of the graph
+    whose edges are the constraints between them. Each component is counted on its
+    own, and the counts are multiplied. Components without cycles are counted by
+    eliminating their variables one at a time: each variable tells the variable it
+    is attached to how many ways there are to complete the component for each of
+    its values. Cyclic components are counted by joining compatibility matrices,
+    counting the values of the last variable instead of listing them.
+
+    Args:
+        search (AssignmentSearch): The search
+        batch_size (int, optional): The approximate number of candidates examined at
+                                    once. Defaults to 65536.
+
+    Returns:
+        int: The number of assignments the search would produce
+    """
+    depth = len(search.variables)
+    # Levels without a mask allow all their values
+    masks: List[Optional[np.ndarray]] = [None for _ in range(depth)]
+    edges: Dict[Tuple[int, ...], List[Constraint]] = {}
+    roots = list(range(depth))
+
+    for level in range(depth):
+        for c in search.checks[level]:
+            c_levels = constraint_levels(search, c)
+            if len(c_levels) == 1:
+                mask = np.fromiter(
+                    (c.check(b) for b in _bindings(search, level)),
+                    dtype=bool,
+                    count=len(search.values[level]),
+                )
+                old = masks[level]
+                masks[level] = mask if old is None else old & mask
+            else:
+                edges.setdefault(tuple(c_levels), []).append(c)
+                for other in c_levels[1:]:
+                    roots[_find_root(roots, other)] = _find_root(roots, c_levels[0])
+
+    components: Dict[int, List[int]] = {}
+    for level in range(depth):
+        components.setdefault(_find_root(roots, level), []).append(level)
+
+    total = 1
+    for levels in components.values():
+        total *= _count_component(search, levels, edges, masks, batch_size)
+        if total == 0:
+            break
+    return total
+
+
+def _find_root(roots: List[int], level: int) -> int:
+    while roots[level] != level:
+        roots[level] = roots[roots[level]]
+        level = roots[level]
+    return level
+
+
+def _bindings(search: AssignmentSearch, level: int) -> Iterable[Dict[str, str]]:
+    # Levels without dependents only bind their own variable, so their bindings
+    # are made as they are needed instead of being listed
+    if len(search.dependents[level]) > 0:
+        return search.bindings(level)
+    variable = search.variables[level]
+    return ({variable: value} for value in search.values[level])
+
+
+def _column(search: AssignmentSearch, level: int, name: str) -> Sequence[str]:
+    # The values of a variable that is bound at a level, for each value of the level
+    if name == search.variables[level]:
+        return search.values[level]
+    return [b[name] for b in search.bindings(level)]
+
+
+def _numbers(search: AssignmentSearch, level: int, name: str) -> np.ndarray:
+    column = _column(search, level, name)
+    return np.fromiter(map(float, column), dtype=float, count=len(column))
+
+
+def _count_component(
+    search: AssignmentSearch,
+    levels: List[int],
+    edges: Dict[Tuple[int, ...], List[Constraint]],
+    masks: List[Optional[np.ndarray]],
+    batch_size: int,
+) -> int:
+    if len(levels) == 1:
+        mask = masks[levels[0]]
+        if mask is None:
+            return len(search.values[levels[0]])
+        return int(np.count_nonzero(mask))
+
+    # The counts of a component are at most the size of its product, so they fit
+    # in 64 bits unless the product does not
+    size = 1
+    for level in levels:
+        size *= len(search.values[level])
+    dtype = np.int64 if size < 1 << 62 else object
+
+    pairs = [key for key in edges if key[0] in levels]
+    if len(pairs) == len(levels) - 1 and all(len(key) == 2 for key in pairs):
+        return _count_tree(search, levels, edges, masks, dtype, batch_size)
+    return _count_joined(search, levels, edges, masks, batch_size)
+
+
+def _count_tree(
+    search: AssignmentSearch,
+    levels: List[int],
+    edges: Dict[Tuple[int, ...], List[Constraint]],
+    masks: List[Optional[np.ndarray]],
+    dtype: Any,
+    batch_size: int,
+) -> int:
+    neighbours: Dict[int, List[int]] = {level: [] for level in levels}
+    for first, second in (key for key in edges if key[0] in neighbours):
+        neighbours[first].append(second)
+        neighbours[second].append(first)
+
+    # Every level is eliminated after the levels that hang from it
+    order = [levels[0]]
+    parents = {levels[0]: -1}
+    visited = 0
+    while visited < len(order):
+        level = order[visited]
+        visited += 1
+        for other in neighbours[level]:
+            if other not in parents:
+                parents[other] = level
+                order.append(other)
+
+    messages: Dict[int, np.ndarray] = {}
+    for level in reversed(order):
+        mask = masks[level]
+        if mask is None:
+            weights = np.ones(len(search.values[level]), dtype=dtype)
+        else:
+            weights = mask.astype(dtype)
+        for child in neighbours[level]:
+            if parents[child] == level:
+                weights = weights * messages[child]
+
+        parent = parents[level]
+        if parent < 0:
+            return int(weights.sum())
+        constraints = edges[(min(level, parent), max(level, parent))]
+        messages[level] = _message(
+            search, level, parent, constraints, weights, batch_size
+        )
+    return 0
+
+
+def _oriented(
+    search: AssignmentSearch, child: int, c: BinaryConstraint
+) -> Tuple[bool, str, str]:
+    # Whether the first variable of a constraint is the one at the child level,
+    # and the names of the variables at the child and at the parent levels
+    if search.levels[c.variable_name] == child:
+        return True, c.variable_name, c.other_name
+    return False, c.other_name, c.variable_name
+
+
+def _message(
+    search: AssignmentSearch,
+    child: int,
+    parent: int,
+    constraints: List[Constraint],
+    weights: np.ndarray,
+    batch_size: int,
+) -> np.ndarray:
+    # The total weight of the values of the child that each value of the parent
+    # allows
+    message = _ordered_message(search, child, parent, constraints, weights)
+    if message is None:
+        message = _equal_message(search, child, parent, constraints, weights)
+    if message is None:
+        message = _matrix_message(
+            search, child, parent, constraints, weights, batch_size
+        )
+    return message
+
+
+def _sorted_weights(
+    numbers: np.ndarray, weights: np.ndarray
+) -> Tuple[np.ndarray, np.ndarray]:
+    # The numbers in increasing order, and the sums of the weights of the first
+    # numbers. NaN is not ordered with or equal to anything, so it is left out.
+    kept = np.logical_not(np.isnan(numbers))
+    values = numbers[kept]
+    cumulative = np.zeros(len(values) + 1, dtype=weights.dtype)
+    # Ranges are already sorted
+    if np.all(values[:-1] <= values[1:]):
+        np.cumsum(weights[kept], out=cumulative[1:])
+    else:
+        order = np.argsort(values, kind="stable")
+        values = values[order]
+        np.cumsum(weights[kept][order], out=cumulative[1:])
+    return values, cumulative
+
+
+def _ordered_message(
+    search: AssignmentSearch,
+    child: int,
+    parent: int,
+    constraints: List[Constraint],
+    weights: np.ndarray,
+) -> Optional[np.ndarray]:
+    # Every constraint bounds the same variable at the child level from above or
+    # below by a variable at the parent level. Sorting the child then lets us sum
+    # the weights between the bounds with two binary searches.
+    column = None
+    below: List[str] = []
+    above: List[str] = []
+    for c in constraints:
+        if not isinstance(c, (LessThanConstraint, GreaterThanConstraint)):
+            return None
+        first, name, other_name = _oriented(search, child, c)
+        if column is not None and column != name:
+            return None
+        column = name
+        if first == isinstance(c, LessThanConstraint):
+            below.append(other_name)
+        else:
+            above.append(other_name)
+
+    if column is None:
+        return None
+
+    values, cumulative = _sorted_weights(_numbers(search, child, column), weights)
+    size = len(search.values[parent])
+    upper = np.full(size, np.inf)
+    lower = np.full(size, -np.inf)
+    for name in below:
+        upper = np.minimum(upper, _numbers(search, parent, name))
+    for name in above:
+        lower = np.maximum(lower, _numbers(search, parent, name))
+
+    high = np.searchsorted(values, upper, "left")
+    low = np.searchsorted(values, lower, "right")
+    message = cumulative[np.maximum(high, low)] - cumulative[low]
+    message[np.isnan(upper) | np.isnan(lower)] = 0
+    return message
+
+
+def _equal_message(
+    search: AssignmentSearch,
+    child: int,
+    parent: int,
+    constraints: List[Constraint],
+    weights: np.ndarray,
+) -> Optional[np.ndarray]:
+    # Every constraint compares the same two variables for equality. The weights
+    # of the child are summed by key, so each value of the parent finds the
+    # weight of the values equal to it with one lookup.
+    columns = None
+    kinds = set()
+    for c in constraints:
+        if not isinstance(c, (EqualityConstraint, InequalityConstraint)):
+            return None
+        _, name, other_name = _oriented(search, child, c)
+        if columns is not None and columns != (name, other_name):
+            return None
+        columns = (name, other_name)
+        kinds.add(type(c))
+
+    if columns is None:
+        return None
+
+    equal = _equal_weights(search, child, parent, columns, weights)
+    if kinds == {EqualityConstraint}:
+        return equal
+    elif kinds == {InequalityConstraint}:
+        return weights.sum() - equal
+    else:
+        # A pair of fillers can not be both equal and not equal
+        return np.zeros(len(equal), dtype=weights.dtype)
+
+
+def _equal_weights(
+    search: AssignmentSearch,
+    child: int,
+    parent: int,
+    columns: Tuple[str, str],
+    weights: np.ndarray,
+) -> np.ndarray:
+    # The total weight of the values of the child that are equal to each value of
+    # the parent
+    try:
+        numbers = _numbers(search, child, columns[0])
+        other_numbers = _numbers(search, parent, columns[1])
+    except ValueError:
+        pass
+    else:
+        # Numbers are equal when they are as fillers, so equal numbers are found
+        # with two binary searches
+        sorted_numbers, cumulative = _sorted_weights(numbers, weights)
+        high = np.searchsorted(sorted_numbers, other_numbers, "right")
+        low = np.searchsorted(sorted_numbers, other_numbers, "left")
+        return cumulative[high] - cumulative[low]
+
+    totals: Dict[Hashable, Any] = {}
+    for i, value in enumerate(_column(search, child, columns[0])):
+        key = equality_key(value)
+        # NaN is not equal to anything, so it has no key to match
+        if key is not None:
+            totals[key] = totals.get(key, 0) + weights[i]
+    others = _column(search, parent, columns[1])
+    return np.array(
+        [totals.get(equality_key(value), 0) for value in others], dtype=weights.dtype
+    )
+
+
+def _matrix_message(
+    search: AssignmentSearch,
+    child: int,
+    parent: int,
+    constraints: List[Constraint],
+    weights: np.ndarray,
+    batch_size: int,
+) -> np.ndarray:
+    matrix = np.ones((len(search.values[child]), len(search.values[parent])), bool)
+    for c in constraints:
+        if not isinstance(c, BinaryConstraint):
+            raise Exception(f"Cannot count the assignments of {c.constraint_name}")
+        first, name, other_name = _oriented(search, child, c)
+        values = list(_column(search, child, name))
+        others = list(_column(search, parent, other_name))
+        if first:
+            matrix &= c.matrix(values, others)
+        else:
+            matrix &= c.matrix(others, values).T
+
+    message = np.zeros(matrix.shape[1], dtype=weights.dtype)
+    step = max(1, batch_size // max(1, matrix.shape[0]))
+    for start in range(0, matrix.shape[1], step):
+        block = matrix[:, start : start + step].T.astype(weights.dtype)
+        message[start : start + step] = block @ weights
+    return message
+
+
+def _count_joined(
+    search: AssignmentSearch,
+    levels: List[int],
+    edges: Dict[Tuple[int, ...], List[Constraint]],
+    masks: List[Optional[np.ndarray]],
+    batch_size: int,
+) -> int:
+    # Only the levels of the component need their bindings
+    bindings: List[List[Dict[str, str]]] = [[] for _ in search.variables]
+    for level in levels:
+        bindings[level] = search.bindings(level)
+
+    positions = {level: i for i, level in enumerate(levels)}
+    pairs: List[Dict[int, np.ndarray]] = [{} for _ in levels]
+    for key in edges:
+        if key[0] not in positions:
+            continue
+        for c in edges[key]:
+            first, second, matrix = pair_matrix(search, c, bindings)
+            i, j = positions[first], positions[second]
+            if i in pairs[j]:
+                matrix = pairs[j][i] & matrix
+            pairs[j][i] = matrix
+
+    component_masks = []
+    for level in levels:
+        mask = masks[level]
+        if mask is None:
+            mask = np.ones(len(search.values[level]), dtype=bool)
+        component_masks.append(mask)
+    matrices = [list(p.items()) for p in pairs]
+
+    total = 0
+    last = len(levels) - 1
+    step = max(1, batch_size // max(1, len(component_masks[last])))
+    start = np.zeros((1, 0), dtype=np.intp)
+    for rows in extend_rows(start, component_masks[:last], matrices, batch_size):
+        for i in range(0, len(rows), step):
+            block = rows[i : i + step]
+            allowed = allowed_values(block, component_masks[last], matrices[last])
+            total += int(np.count_nonzero(allowed))
+    return total
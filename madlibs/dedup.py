@@ -0,0 +1,204 @@
+import abc
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import sys
+import tempfile
+from typing import Any, Dict, Optional, Set
+
+
+def dedup_key(generated: Dict[str, str]) -> bytes:
+    """Make a compact key that identifies the texts generated for an item
+
+    Args:
+        generated (Dict[str, str]): The text generated from each template
+
+    Returns:
+        bytes: A 16 byte digest of the texts
+    """
+    data = json.dumps(generated).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+class DedupStore(abc.ABC):
+    """A dedup store remembers the keys of the items that have been produced, so that
+    items that repeat earlier ones can be dropped."""
+
+    @abc.abstractmethod
+    def add(self, key: bytes) -> bool:
+        """Add a key to the store
+
+        Args:
+            key (bytes): The key
+
+        Returns:
+            bool: True if the key was not in the store before
+        """
+
+    @abc.abstractmethod
+    def memory_usage(self) -> int:
+        """An estimate of the memory that the store takes
+
+        Returns:
+            int: The number of bytes
+        """
+
+    @abc.abstractmethod
+    def close(self) -> None:
+        """Release the resources held by the store"""
+
+
+class MemoryDedupStore(DedupStore):
+    """An exact store that keeps every key in a set in memory"""
+
+    keys: Set[bytes]
+
+    def __init__(self) -> None:
+        self.keys = set()
+
+    def add(self, key: bytes) -> bool:
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def memory_usage(self) -> int:
+        per_key = sys.getsizeof(b"0" * 16)
+        return sys.getsizeof(self.keys) + per_key * len(self.keys)
+
+    def close(self) -> None:
+        self.keys = set()
+
+
+class SqliteDedupStore(DedupStore):
+    """An exact store that keeps the keys in an SQLite database on disk. Only the
+    page cache of the database is held in memory."""
+
+    path: str
+    connection: sqlite3.Connection
+    __temporary: bool
+    __pending: int
+
+    def __init__(self, path: Optional[str] = None, cache_size: int = 1 << 26) -> None:
+        """Open a new store
+
+        Args:
+            path (Optional[str], optional): The database file. Defaults to None, for
+                                            a temporary file that is deleted when the
+                                            store is closed.
+            cache_size (int, optional): The maximum number of bytes of the database
+                                        to cache in memory. Defaults to 64MB.
+        """
+        self.__temporary = path is None
+        if path is None:
+            handle, path = tempfile.mkstemp(suffix=".sqlite")
+            os.close(handle)
+        self.path = path
+        self.__pending = 0
+
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute(f"PRAGMA cache_size = -{max(1, cache_size >> 10)}")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS seen (key BLOB PRIMARY KEY) WITHOUT ROWID"
+        )
+
+    def add(self, key: bytes) -> bool:
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO seen (key) VALUES (?)", (key,)
+        )
+        # Commit in batches, since every commit is a write to the disk
+        self.__pending += 1
+        if self.__pending >= 10000:
+            self.connection.commit()
+            self.__pending = 0
+        return cursor.rowcount == 1
+
+    def memory_usage(self) -> int:
+        page_size = self.connection.execute("PRAGMA page_size").fetchone()[0]
+        page_count = self.connection.execute("PRAGMA page_count").fetchone()[0]
+        cache_size = self.connection.execute("PRAGMA cache_size").fetchone()[0]
+        cached_pages = -cache_size * 1024 // page_size if cache_size < 0 else cache_size
+        return page_size * min(page_count, cached_pages)
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+        if self.__temporary:
+            os.remove(self.path)
+
+
+class BloomDedupStore(DedupStore):
+    """An approximate store that keeps the keys in a Bloom filter. It uses a fixed
+    amount of memory, but it can mistake a new key for one it has seen, and drop it.
+    This happens with the given probability as long as the number of keys stays
+    below the capacity. It never keeps a key that it has seen before."""
+
+    capacity: int
+    error_rate: float
+    num_bits: int
+    num_hashes: int
+    bits: bytearray
+
+    def __init__(self, capacity: int, error_rate: float = 1e-6) -> None:
+        """Make an empty filter
+
+        Args:
+            capacity (int): The number of keys the filter is sized for
+            error_rate (float, optional): The probability that a new key is taken for
+                                          one that has been seen, when the filter
+                                          is full. Defaults to 1e-6.
+        """
+        if capacity < 1 or not 0 < error_rate < 1:
+            raise Exception("Invalid capacity or error rate for a Bloom filter")
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+        num_bits = -capacity * math.log(error_rate) / (math.log(2) ** 2)
+        self.num_bits = max(8, int(math.ceil(num_bits)))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def add(self, key: bytes) -> bool:
+        # Double hashing derives all the positions from two halves of one digest
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+
+        is_new = False
+        for i in range(self.num_hashes):
+            position = (first + i * second) % self.num_bits
+            byte, bit = position >> 3, 1 << (position & 7)
+            if not self.bits[byte] & bit:
+                self.bits[byte] |= bit
+                is_new = True
+        return is_new
+
+    def memory_usage(self) -> int:
+        return len(self.bits)
+
+    def close(self) -> None:
+        self.bits = bytearray(len(self.bits))
+
+
+def make_dedup_store(name: str, **kwargs: Any) -> DedupStore:
+    """Make a dedup store by name
+
+    Args:
+        name (str): Either "memory", "disk" or "bloom"
+        kwargs: The arguments of the store
+
+    Returns:
+        DedupStore: The new store
+    """
+    if name == "memory":
+        return MemoryDedupStore(**kwargs)
+    elif name == "disk":
+        return SqliteDedupStore(**kwargs)
+    elif name == "bloom":
+        return BloomDedupStore(**kwargs)
+    else:
+        raise Exception(f"Unknown dedup store {name}")
@@ -1,9 +1,27 @@
 import abc
+import bisect
+import hashlib
+import json
+import math
 from numbers import Number
-from typing import Any, Dict, List, Optional, Set
-
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+import numpy as np
 from jinja2 import Environment
 
+from madlibs.constraints import FillerKeys, FillerNumbers, filler_key
 from madlibs.core import FillerType, known_domains
 
 
@@ -37,6 +55,26 @@ class Domain(abc.ABC):
             [type]: A unified type that represents both this domain and the other one.
         """
 
+    def number_parser(self) -> Optional[Callable[[str], float]]:
+        """Find a function that gives the number of each filler of this domain
+        without parsing it again
+
+        Returns:
+            Optional[Callable[[str], float]]: The function, or None if the fillers
+            are not all known to be numbers
+        """
+        return None
+
+    def key_parser(self) -> Optional[Callable[[str], Any]]:
+        """Find a function that gives the key of each filler of this domain for the
+        equals and not_equals constraints without parsing it again
+
+        Returns:
+            Optional[Callable[[str], Any]]: The function, or None if the fillers
+            are not known in advance
+        """
+        return None
+
 
 class IndependentDomain(Domain):
     def __init__(self, variable_name: str, variable_type: str) -> None:
@@ -50,41 +88,268 @@ class IndependentDomain(Domain):
             List[str]: A list of values that this variable can take
         """
 
+    def realize(self) -> Sequence[str]:
+        """Find the fillers that define this type, in the same order as
+        generate_domain. Domains that can compute their fillers on demand do not
+        have to list them.
+
+        Returns:
+            Sequence[str]: The values that this variable can take
+        """
+        return self.generate_domain()
+
+
+def parse_fillers(values: Iterable[str]) -> Tuple[FillerNumbers, FillerKeys]:
+    """Parse fillers in advance, for the constraints to look up
+
+    Args:
+        values (Iterable[str]): The fillers
+
+    Returns:
+        Tuple[FillerNumbers, FillerKeys]: The numbers of the numeric fillers, and
+        the keys of all of them
+    """
+    numbers = FillerNumbers()
+    keys = FillerKeys()
+    for value in values:
+        key = filler_key(value)
+        keys[value] = key
+        if isinstance(key, float):
+            numbers[value] = key
+    return numbers, keys
+
+
+class FillerValues:
+    """The values of a type of fillers, with the dependents of each value. These
+    only depend on the fillers and the type, so they can be shared by all the
+    filler domains of that type.
+
+    Every distinct value gets an integer code, its position in the list of values.
+    The dependents are stored by column: for each dependent variable, a list with
+    the value of that variable for each code.
+
+    Repeated fillers are only kept once, at their first position, so that every
+    combination of fillers in a template group is distinct. If a repeated filler
+    has dependents, the last ones are used.
+
+    The values are parsed once, into the numbers of the numeric ones and the keys
+    of all of them. The value type is "number" if every value is numeric, and
+    "string" otherwise. The values of each dependent variable are parsed the same
+    way, into column_numbers and column_keys.
+
+    The digest identifies the fillers and the type, so that values that were built
+    apart, like in another process, can be told to be the same."""
+
+    values: List[str]
+    codes: Dict[str, int]
+    columns: Dict[str, List[Optional[str]]]
+    dependent_variables: Set[str]
+    has_dependents: bool
+    value_type: str
+    numbers: FillerNumbers
+    keys: FillerKeys
+    column_numbers: Dict[str, FillerNumbers]
+    column_keys: Dict[str, FillerKeys]
+    digest: str
+
+    def __init__(self, variable_type: str, fillers: List[FillerType]) -> None:
+        data = json.dumps([variable_type, fillers], sort_keys=True)
+        self.digest = hashlib.sha256(data.encode("utf-8")).hexdigest()
+        self.values = []
+        self.codes = {}
+        records: List[Optional[Dict[str, str]]] = []
+        for item in fillers:
+            value = item if isinstance(item, str) else item[variable_type]
+            code = self.codes.get(value)
+            if code is None:
+                code = len(self.values)
+                self.codes[value] = code
+                self.values.append(value)
+                records.append(None)
+            if not isinstance(item, str):
+                records[code] = item
+
+        # if there are dependents, every value should have a dependent
+        self.has_dependents = any(r is not None for r in records)
+        if self.has_dependents:
+            for code, record in enumerate(records):
+                if record is None:
+                    raise Exception(f"Missing dependents for value {self.values[code]}")
+
+        self.columns = self.__make_columns(variable_type, records)
+        self.dependent_variables = set(self.columns)
+        self.__parse_values()
+
+    def __parse_values(self) -> None:
+        self.numbers, self.keys = parse_fillers(self.values)
+        is_number = len(self.numbers) == len(self.values)
+        self.value_type = "number" if is_number else "string"
+
+        # Only the columns whose values are all numbers get their numbers
+        self.column_numbers = {}
+        self.column_keys = {}
+        for name, column in self.columns.items():
+            values = set(value for value in column if value is not None)
+            numbers, keys = parse_fillers(values)
+            self.column_keys[name] = keys
+            if len(numbers) == len(values):
+                self.column_numbers[name] = numbers
+
+    def __make_columns(
+        self, variable_type: str, records: List[Optional[Dict[str, str]]]
+    ) -> Dict[str, List[Optional[str]]]:
+        columns: Dict[str, List[Optional[str]]] = {}
+        for code, record in enumerate(records):
+            for key in record or {}:
+                if key != variable_type:
+                    if key not in columns:
+                        columns[key] = [None] * len(records)
+                    columns[key][code] = record[key]  # type: ignore
+        return columns
+
+    @property
+    def dependents(self) -> Dict[str, Dict[str, str]]:
+        """The dependents of each value, as a dictionary. This is built on every
+        call, and is only meant for inspection.
+
+        Returns:
+            Dict[str, Dict[str, str]]: The values of the dependent variables, by
+            value
+        """
+        if not self.has_dependents:
+            return {}
+
+        output: Dict[str, Dict[str, str]] = {}
+        for code, value in enumerate(self.values):
+            output[value] = {}
+            for name, column in self.columns.items():
+                dependent = column[code]
+                if dependent is not None:
+                    output[value][name] = dependent
+        return output
+
+    def lookup(self, code: int, dependent_name: str) -> str:
+        """Find the value of a dependent variable
+
+        Args:
+            code (int): The code of the value of the parent
+            dependent_name (str): The dependent variable
+
+        Raises:
+            KeyError: If the filler has no such dependent
+
+        Returns:
+            str: The value of the dependent variable
+        """
+        dependent = self.columns[dependent_name][code]
+        if dependent is None:
+            raise KeyError(dependent_name)
+        return dependent
+
+
+class FillerIndex(Dict[str, List[FillerType]]):
+    """A filler index is a dictionary of fillers by type that also keeps the values
+    of each type once they have been collected. Templates and groups that are built
+    from the same filler index share these values, instead of collecting them for
+    every variable.
+
+    The index also maps every field of the fillers that are records to the key of
+    the first fillers that have it. The fillers should not be changed once they are
+    in an index."""
+
+    __values: Dict[Tuple[str, str], FillerValues]
+    __fields: Optional[Dict[str, str]]
+
+    def __init__(self, fillers: Dict[str, List[FillerType]]) -> None:
+        super().__init__(fillers)
+        self.__values = {}
+        self.__fields = None
+
+    def field_key(self, field: str) -> Optional[str]:
+        """Find the fillers that are records with a field
+
+        Args:
+            field (str): The field
+
+        Returns:
+            Optional[str]: The key of the first fillers whose first record has the
+            field, or None if there are none
+        """
+        if self.__fields is None:
+            self.__fields = {}
+            for key in self:
+                sample = self[key][0] if len(self[key]) > 0 else None
+                if isinstance(sample, dict):
+                    for name in sample:
+                        self.__fields.setdefault(name, key)
+        return self.__fields.get(field)
+
+    def filler_values(self, key: str, variable_type: str) -> FillerValues:
+        """Get the values of a type of fillers
+
+        Args:
+            key (str): The key of the fillers that contain the type
+            variable_type (str): The type. This is either the key, or a field of
+                                 the fillers under the key.
+
+        Returns:
+            FillerValues: The values, which are shared by all the callers
+        """
+        if (key, variable_type) not in self.__values:
+            values = FillerValues(variable_type, self[key])
+            self.__values[(key, variable_type)] = values
+        return self.__values[(key, variable_type)]
+
+
+def find_field_key(fillers: Dict[str, List[FillerType]], field: str) -> Optional[str]:
+    if isinstance(fillers, FillerIndex):
+        return fillers.field_key(field)
+    for key in fillers:
+        sample = fillers[key][0]
+        if isinstance(sample, dict) and field in sample:
+            return key
+    return None
+
+
+def filler_values(
+    fillers: Dict[str, List[FillerType]], key: str, variable_type: str
+) -> FillerValues:
+    if isinstance(fillers, FillerIndex):
+        return fillers.filler_values(key, variable_type)
+    return FillerValues(variable_type, fillers[key])
+
 
 class FillerDomain(IndependentDomain):
     """A filler domain is an independent domain. Variables that are defined to
-    belong to a filler domain can take values from a specific list of fillers."""
+    belong to a filler domain can take values from a specific list of fillers.
 
+    The values come from FillerValues, which explains how repeated fillers are
+    handled. They can be shared with other domains, and should not be changed."""
+
+    fillers: FillerValues
     values: List[str]
-    # fillers: List[FillerType]
-    dependents: Dict[str, Dict[str, str]]
+    codes: Dict[str, int]
     dependent_variables: Set[str]
+    value_type: str
 
     def __init__(
-        self, variable_name: str, variable_type: str, fillers: List[FillerType]
+        self,
+        variable_name: str,
+        variable_type: str,
+        fillers: Union[List[FillerType], FillerValues],
     ) -> None:
         super().__init__(variable_name=variable_name, variable_type=variable_type)
-        # self.fillers = fillers
-        self.values = []
-        self.dependents = {}
-        self.dependent_variables = set()
-        for item in fillers:
-            if isinstance(item, str):
-                self.values.append(item)
-            else:
-                value = item[variable_type]
-                self.values.append(value)
-                self.dependents[value] = {}
-                for key in item:
-                    if key != variable_type:
-                        self.dependents[value][key] = item[key]
-                        self.dependent_variables.add(key)
-
-        # if there are dependents, every value should have a dependent
-        if len(self.dependents) > 0:
-            for v in self.values:
-                if v not in self.dependents:
-                    raise Exception(f"Missing dependents for value {v}")
+        if not isinstance(fillers, FillerValues):
+            fillers = FillerValues(variable_type, fillers)
+        self.fillers = fillers
+        self.values = fillers.values
+        self.codes = fillers.codes
+        self.dependent_variables = fillers.dependent_variables
+        self.value_type = fillers.value_type
+
+    @property
+    def dependents(self) -> Dict[str, Dict[str, str]]:
+        return self.fillers.dependents
 
     def __repr__(self) -> str:
         values = "[" + ", ".join(self.values) + "]"
@@ -97,7 +362,29 @@ class FillerDomain(IndependentDomain):
         return self.values
 
     def lookup_dependent(self, value: str, dependent_name: str) -> str:
-        return self.dependents[value][dependent_name]
+        return self.fillers.lookup(self.codes[value], dependent_name)
+
+    def share_values(self, shared: Dict[str, FillerValues]) -> None:
+        """Use the values that are shared under the digest of the values of this
+        domain, or share them if there are none yet
+
+        Args:
+            shared (Dict[str, FillerValues]): The shared values, by digest
+        """
+        fillers = shared.setdefault(self.fillers.digest, self.fillers)
+        self.fillers = fillers
+        self.values = fillers.values
+        self.codes = fillers.codes
+        self.dependent_variables = fillers.dependent_variables
+        self.value_type = fillers.value_type
+
+    def number_parser(self) -> Optional[Callable[[str], float]]:
+        if self.value_type != "number":
+            return None
+        return self.fillers.numbers.__getitem__
+
+    def key_parser(self) -> Optional[Callable[[str], Any]]:
+        return self.fillers.keys.__getitem__
 
     def unify_with(self, other: Domain) -> Optional[Domain]:
         self_is_type = self.is_reference_to_type()
@@ -136,14 +423,186 @@ class FillerDomain(IndependentDomain):
             return None
 
 
+class RangeValues(Sequence[str]):
+    """The values of a range of numbers, computed when they are needed instead of
+    being listed. The values are the ones that adding the step to the start over
+    and over gives, printed as fillers, so fractional steps print the same rounding
+    errors as the listed values always did.
+
+    Ranges of integers find each value by arithmetic. Other ranges keep one value
+    in every RANGE_CHECKPOINT, and find the others by adding the step to the value
+    kept before them.
+
+    Positions of the values that are less than or greater than a number are found
+    by arithmetic, or by bisecting the kept values, so ordered constraints on a
+    range can be solved without looking at all its values.
+    """
+
+    start: Number
+    step: Number
+    size: int
+    checkpoints: Optional[List[float]]
+
+    def __init__(self, start: Number, end: Number, step: Number) -> None:
+        if not step > 0:  # type: ignore
+            raise Exception(f"The step of a range should be positive, not {step}")
+        self.start = start
+        self.step = step
+        self.size = 0
+        self.checkpoints = None
+        if not isinstance(start, int) or not isinstance(step, int):
+            self.__accumulate(end)
+        elif end > start:  # type: ignore
+            # The end can still be fractional, so the size is checked against the
+            # values themselves
+            size = math.ceil((end - start) / step)  # type: ignore
+            while size > 0 and self.number(size - 1) >= end:  # type: ignore
+                size -= 1
+            while self.number(size) < end:  # type: ignore
+                size += 1
+            self.size = size
+
+    def __accumulate(self, end: Number) -> None:
+        # The additions are replayed in blocks, in the same order as one at a time
+        checkpoints: List[float] = []
+        blocks = RANGE_CHECKPOINT * RANGE_CHECKPOINT
+        n = self.start
+        while n < end:  # type: ignore
+            steps = np.full(blocks, self.step, dtype=float)
+            steps[0] = n
+            block = np.add.accumulate(steps)
+            count = int(np.searchsorted(block, end))  # type: ignore
+            checkpoints.extend(block[:count:RANGE_CHECKPOINT].tolist())
+            self.size += count
+            if count < blocks:
+                break
+            if block[-1] == block[-2]:
+                raise Exception(f"The step {self.step} is too small for its range")
+            n = float(block[-1]) + self.step  # type: ignore
+        self.checkpoints = checkpoints
+
+    def __repr__(self) -> str:
+        return f"RangeValues({self.start}, {self.step}, size={self.size})"
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, index: Any) -> Any:
+        # Slices give a list of the values
+        if isinstance(index, slice):
+            first, stop, stride = index.indices(self.size)
+            if stride == 1:
+                return list(self.__values(first, max(first, stop)))
+            return [str(self.number(i)) for i in range(first, stop, stride)]
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError(f"{index} is not in a range of {self.size} values")
+        return str(self.number(index))
+
+    def __iter__(self) -> Iterator[str]:
+        return self.__values(0, self.size)
+
+    def __values(self, first: int, stop: int) -> Iterator[str]:
+        n = self.number(first)
+        for _ in range(first, stop):
+            yield str(n)
+            n += self.step  # type: ignore
+
+    def number(self, index: int) -> Number:
+        # The start is given as it is, even if the other values are fractional
+        if index == 0:
+            return self.start
+        if self.checkpoints is None:
+            return self.start + index * self.step  # type: ignore
+        n = self.checkpoints[index // RANGE_CHECKPOINT]
+        for _ in range(index % RANGE_CHECKPOINT):
+            n += self.step  # type: ignore
+        return n  # type: ignore
+
+    def bisect_left(self, number: float) -> int:
+        """Find the number of values that are less than a number
+
+        Args:
+            number (float): The number. It should not be NaN.
+
+        Returns:
+            int: The position of the first value that is at least the number
+        """
+        if self.size == 0 or number <= self.number(0):  # type: ignore
+            return 0
+        if number > self.number(self.size - 1):  # type: ignore
+            return self.size
+
+        if self.checkpoints is not None:
+            # Start from the last kept value that is less than the number
+            kept = max(bisect.bisect_left(self.checkpoints, number) - 1, 0)
+            position = kept * RANGE_CHECKPOINT
+            n = self.checkpoints[kept]
+            while position < self.size and n < number:
+                n += self.step  # type: ignore
+                position += 1
+            return position
+
+        position = math.ceil((number - self.start) / self.step)  # type: ignore
+        position = min(max(position, 0), self.size)
+        while position > 0 and self.number(position - 1) >= number:  # type: ignore
+            position -= 1
+        while position < self.size and self.number(position) < number:  # type: ignore
+            position += 1
+        return position
+
+    def bisect_right(self, number: float) -> int:
+        """Find the number of values that are at most a number
+
+        Args:
+            number (float): The number. It should not be NaN.
+
+        Returns:
+            int: The position of the first value that is greater than the number
+        """
+        position = self.bisect_left(number)
+        while position < self.size and self.number(position) == number:
+            position += 1
+        return position
+
+    def position(self, value: str) -> Optional[int]:
+        """Find the position of a filler in the range
+
+        Args:
+            value (str): The filler
+
+        Returns:
+            Optional[int]: The position, or None if the filler is not in the range
+        """
+        try:
+            number = float(value)
+        except ValueError:
+            return None
+        if number != number:
+            return None
+        position = self.bisect_left(number)
+        if position < self.size and str(self.number(position)) == value:
+            return position
+        return None
+
+
+# The number of values of a fractional range between the values that it keeps
+RANGE_CHECKPOINT = 256
+
+
 class RangeDomain(IndependentDomain):
     """A range domain is defined by a range of numbers. Variables defined to belong to
     this domain can take values in this range.
+
+    The range is kept as its start, end and step. Its values are only computed when
+    they are needed, so large ranges cost little memory until they are listed.
     """
 
     start: Number
     end: Number
     step: Number
+    value_type: str
 
     def __init__(
         self,
@@ -165,19 +624,25 @@ class RangeDomain(IndependentDomain):
         self.start = start
         self.end = end
         self.step = step
+        self.value_type = "number"
 
     def __repr__(self) -> str:
         values = ", ".join([str(self.start), str(self.end), str(self.step)])
         return self.variable_name + f": range({values})"
 
     def generate_domain(self) -> List[str]:
-        numeric_range: List[str] = []
-        n = self.start
-        while n < self.end:  # type: ignore
-            numeric_range.append(str(n))
-            n += self.step  # type: ignore
+        return list(self.realize())
 
-        return numeric_range
+    def realize(self) -> RangeValues:
+        return RangeValues(self.start, self.end, self.step)
+
+    def number_parser(self) -> Optional[Callable[[str], float]]:
+        # The values of a range are always numbers, so they are parsed without
+        # being kept
+        return float
+
+    def key_parser(self) -> Optional[Callable[[str], Any]]:
+        return float
 
     def unify_with(self, other: Domain) -> Optional[Domain]:
         if isinstance(other, RangeDomain):
@@ -196,6 +661,7 @@ class RangeDomain(IndependentDomain):
 
 class DependentDomain(Domain):
     args: List[str]
+    parent_names: List[str]
 
     def __init__(
         self,
@@ -208,6 +674,7 @@ class DependentDomain(Domain):
         args_string = ",".join(a)
         super().__init__(variable_name, f"{variable_name}({args_string})")
         self.args = list(args)
+        self.parent_names = a
 
     def __repr__(self) -> str:
         return self.variable_type
@@ -247,6 +714,19 @@ class FillerDependentDomain(DependentDomain):
             self.variable_name,
         )
 
+    def number_parser(self) -> Optional[Callable[[str], float]]:
+        # The values are the column of this variable in the values of the parent
+        numbers = self.parent.fillers.column_numbers.get(self.variable_name)
+        if numbers is None:
+            return None
+        return numbers.__getitem__
+
+    def key_parser(self) -> Optional[Callable[[str], Any]]:
+        keys = self.parent.fillers.column_keys.get(self.variable_name)
+        if keys is None:
+            return None
+        return keys.__getitem__
+
     def unify_with(self, other: Domain) -> Optional[Domain]:
         d = super().unify_with(other)
         if d is None:
@@ -265,6 +745,23 @@ class FillerDependentDomain(DependentDomain):
         return d
 
 
+class CollectedDependents(Dict[str, Domain]):
+    """The dependent domains collected from the templates of a group, by variable.
+    It also keeps the names of the variables that the filler dependents depend on,
+    so that checking whether a variable is a parent takes constant time."""
+
+    parents: Set[str]
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.parents = set()
+
+    def __setitem__(self, variable: str, domain: Domain) -> None:
+        super().__setitem__(variable, domain)
+        if isinstance(domain, FillerDependentDomain):
+            self.parents.add(domain.parent.variable_name)
+
+
 def make_filler_domain(
     variable_name: str,
     fillers: Dict[str, List[FillerType]],
@@ -275,23 +772,18 @@ def make_filler_domain(
 
     variable_type = args[0]
     if variable_type in fillers:
-        items = fillers[variable_type]
-        return [FillerDomain(variable_name, variable_type, items)]
+        values = filler_values(fillers, variable_type, variable_type)
+        return [FillerDomain(variable_name, variable_type, values)]
     else:
-        domains: List[Domain] = []
-        for key in fillers:
-            sample = fillers[key][0]
-            if not (isinstance(sample, dict) and variable_type in sample):
-                continue
-
-            parent = FillerDomain(variable_name, variable_type, fillers[key])
-            domains.append(parent)
-            for child_variable_type in parent.dependent_variables:
-                child = FillerDependentDomain(child_variable_type, parent)
-                domains.append(child)
-            break
-        if len(domains) == 0:
+        key = find_field_key(fillers, variable_type)
+        if key is None:
             raise Exception(f"Unknown domain for {variable_name}")
+
+        values = filler_values(fillers, key, variable_type)
+        parent = FillerDomain(variable_name, variable_type, values)
+        domains: List[Domain] = [parent]
+        for child_variable_type in parent.dependent_variables:
+            domains.append(FillerDependentDomain(child_variable_type, parent))
         return domains
 
 
@@ -1,39 +1,101 @@
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Set, Tuple
 
-from madlibs.constraints import Constraint
+from madlibs.compiled import TemplateCache
+from madlibs.constraints import BinaryConstraint, Constraint
 from madlibs.core import FillerType
-from madlibs.domains import DependentDomain, Domain, IndependentDomain, try_unify
+from madlibs.domains import (
+    CollectedDependents,
+    DependentDomain,
+    Domain,
+    FillerDependentDomain,
+    FillerDomain,
+    FillerIndex,
+    FillerValues,
+    IndependentDomain,
+    RangeDomain,
+    try_unify,
+)
+from madlibs.join import CompatibilityJoin
+from madlibs.search import AssignmentSearch
 from madlibs.template import MadLibTemplate
 
 
+def domain_signature(domain: Domain) -> Hashable:
+    """Describe the values that a domain gives its variable. Domains with the same
+    signature give the same values in the same order.
+
+    Args:
+        domain (Domain): The domain
+
+    Returns:
+        Hashable: The signature
+    """
+    # Filler values are compared by their digest, so that groups built separately,
+    # like in other processes or from bundles, still match
+    if isinstance(domain, FillerDomain):
+        return ("filler", domain.variable_type, domain.fillers.digest)
+    elif isinstance(domain, RangeDomain):
+        return ("range", domain.start, domain.end, domain.step)
+    elif isinstance(domain, FillerDependentDomain):
+        parent = domain.parent
+        return ("dependent", parent.variable_name, parent.fillers.digest)
+    else:
+        return ("domain", id(domain))
+
+
 class MadLibTemplateGroup:
     """A MadLibTemplateGroup is a collection of templates that are jointly realized
     via joint assignments to their shared variables. The template group is defined
     by the list of templates it contains, and the domains of the variables involved.
 
+    Variables are ordered by their first appearance in the templates, taken in the
+    order in which they are given. Everything that depends on an order of the
+    variables, like the order of generation, uses this order, so that it is the
+    same in every process.
+
+    Templates that do not depend on all the independent variables of the group
+    keep the texts they render, since many assignments share the values of their
+    variables. The others would never reuse a text, so they are rendered directly.
     """
 
     templates: Dict[str, MadLibTemplate]
     variables: Set[str]
+    variable_order: List[str]
     constraints: Dict[str, List[Constraint]]
     domains: Dict[str, Domain]
+    memoized: Set[str]
+    __search: Optional[AssignmentSearch]
+    __join: Optional[CompatibilityJoin]
 
     def __init__(
         self,
         templates: Dict[str, str],
         fillers: Dict[str, List[FillerType]],
+        cache: Optional[TemplateCache] = None,
     ) -> None:
+        if cache is None:
+            cache = TemplateCache()
+        # The templates share the values of each type of fillers
+        if not isinstance(fillers, FillerIndex):
+            fillers = FillerIndex(fillers)
         self.templates = {}
         self.variables = set()
+        self.variable_order = []
         self.constraints = {}
         self.domains = {}
-        collected_dependents: Dict[str, Domain] = {}
+        self.__search = None
+        self.__join = None
+        collected_dependents = CollectedDependents()
         for template_name in templates:
-            t = MadLibTemplate(templates[template_name], fillers, collected_dependents)
+            t = MadLibTemplate(
+                templates[template_name], fillers, collected_dependents, cache
+            )
             self.templates[template_name] = t
             self.variables.update(t.variables)
 
-            for variable_name in t.variables:
+            for variable_name in t.variable_order:
+                if variable_name not in self.variable_order:
+                    self.variable_order.append(variable_name)
                 if variable_name not in self.constraints:
                     self.constraints[variable_name] = []
                 self.constraints[variable_name].extend(t.constraints[variable_name])
@@ -52,28 +114,123 @@ class MadLibTemplateGroup:
         if len(self.variables) != len(self.domains):
             raise Exception("Not all variables have domains!")
 
-    def realize_independent_domains(self) -> Dict[str, List[str]]:
-        output: Dict[str, List[str]] = {}
+        self.__specialize_constraints()
+        self.memoized = self.__find_memoized()
+
+    def __find_memoized(self) -> Set[str]:
+        # The templates whose variables do not determine all the independent
+        # variables of the group
+        independent = set()
+        for variable in self.variable_order:
+            if isinstance(self.domains[variable], IndependentDomain):
+                independent.add(variable)
+
+        output = set()
+        for name, t in self.templates.items():
+            reads: Set[str] = set()
+            pending = list(t.variables)
+            while len(pending) > 0:
+                variable = pending.pop()
+                domain = self.domains.get(variable)
+                if isinstance(domain, DependentDomain):
+                    pending.extend(p for p in domain.parent_names if p not in reads)
+                reads.add(variable)
+            if not independent.issubset(reads):
+                output.add(name)
+        return output
+
+    def __specialize_constraints(self) -> None:
+        # The domains are final, so the constraints can compare the values that
+        # the domains parsed instead of parsing the fillers on every check
+        numbers: Dict[str, Callable[[str], float]] = {}
+        keys: Dict[str, Callable[[str], Any]] = {}
+        for variable, domain in self.domains.items():
+            number_parser = domain.number_parser()
+            if number_parser is not None:
+                numbers[variable] = number_parser
+            key_parser = domain.key_parser()
+            if key_parser is not None:
+                keys[variable] = key_parser
+
+        for variable in self.variable_order:
+            for c in self.constraints[variable]:
+                if isinstance(c, BinaryConstraint):
+                    c.specialize(numbers, keys)
+
+    def attach(self, shared: Dict[str, FillerValues], cache: TemplateCache) -> None:
+        """Make a group that was built elsewhere, like in another process or from a
+        bundle, share the values of its fillers and its template cache with other
+        groups
 
-        for variable in self.variables:
+        Args:
+            shared (Dict[str, FillerValues]): The shared values, by digest. Values
+                that are not shared yet are added.
+            cache (TemplateCache): The shared cache
+        """
+        domains = list(self.domains.values())
+        for t in self.templates.values():
+            domains.extend(t.domains.values())
+            t.cache = cache
+            t.compiled = cache.compile(t.source)
+        for domain in domains:
+            if isinstance(domain, FillerDependentDomain):
+                domain = domain.parent
+            if isinstance(domain, FillerDomain):
+                domain.share_values(shared)
+
+        # The search, the join and the constraints refer to the old values
+        self.__search = None
+        self.__join = None
+        self.__specialize_constraints()
+
+    def realize_independent_domains(self) -> Dict[str, Sequence[str]]:
+        output: Dict[str, Sequence[str]] = {}
+
+        for variable in self.variable_order:
             domain = self.domains[variable]
             if isinstance(domain, IndependentDomain):
-                values = domain.generate_domain()
+                values = domain.realize()
                 output[domain.variable_name] = values
         return output
 
+    def signature(self) -> Hashable:
+        """Describe the assignments of the group. Groups with the same signature have
+        the same variables, domains and constraints, so they have the same valid
+        assignments in the same order, whatever their templates render.
+
+        Returns:
+            Hashable: The signature
+        """
+        output = []
+        for variable in self.variable_order:
+            constraints = sorted(
+                (c.constraint_name, tuple(c.variables()))
+                for c in self.constraints[variable]
+            )
+            domain = domain_signature(self.domains[variable])
+            output.append((variable, domain, tuple(constraints)))
+        return tuple(output)
+
     def realize_dependent_domains(self, fillers: Dict[str, str]) -> Dict[str, str]:
-        output = {}
-        for variable in self.variables:
-            domain = self.domains[variable]
-            if isinstance(domain, DependentDomain):
-                output[variable] = domain.value(fillers)
-            else:
-                output[variable] = fillers[variable]
-        return output
+        # The search looks up the dependents in the same tables as it binds them from
+        return self.search().complete(fillers)
+
+    def search(self) -> AssignmentSearch:
+        # The group does not change after it is built, so neither does the search
+        if self.__search is None:
+            self.__search = AssignmentSearch(
+                self.realize_independent_domains(), self.domains, self.constraints
+            )
+        return self.__search
+
+    def compatibility_join(self) -> CompatibilityJoin:
+        # The join is built from the search, and does not change either
+        if self.__join is None:
+            self.__join = CompatibilityJoin(self.search())
+        return self.__join
 
     def __check_constraints(self, fillers: Dict[str, str]) -> bool:
-        for variable in self.variables:
+        for variable in self.variable_order:
             for c in self.constraints[variable]:
                 if not c.check(fillers):
                     return False
@@ -84,7 +241,7 @@ class MadLibTemplateGroup:
     ) -> Optional[Tuple[Dict[str, str], Dict[str, str]]]:
         # All variables should be in the reconciled fillers. If not, we
         # need to raise an exception
-        for v in self.variables:
+        for v in self.variable_order:
             if v not in fillers:
                 raise Exception(f"Variable {v} assigned any fillers")
 
@@ -92,12 +249,22 @@ class MadLibTemplateGroup:
         if not self.__check_constraints(fillers):
             return None
         else:
-            relevant_params: Dict[str, str] = {}
-            generated: Dict[str, str] = {}
-            for k in self.templates:
+            return self.render_assignment(fillers)
+
+    def render_assignment(
+        self, fillers: Dict[str, str]
+    ) -> Tuple[Dict[str, str], Dict[str, str]]:
+        # The fillers are expected to satisfy all the constraints. Use render if
+        # that is not known.
+        relevant_params: Dict[str, str] = {}
+        generated: Dict[str, str] = {}
+        for k in self.templates:
+            if k in self.memoized:
+                generated[k] = self.templates[k].render_memoized(fillers)
+            else:
                 generated[k] = self.templates[k].render(fillers)
 
-            for v in self.variables:
-                relevant_params[v] = fillers[v]
+        for v in self.variable_order:
+            relevant_params[v] = fillers[v]
 
-            return relevant_params, generated
+        return relevant_params, generated
@@ -0,0 +1,231 @@
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from madlibs.constraints import BinaryConstraint, Constraint
+from madlibs.search import AssignmentSearch
+
+
+def constraint_levels(search: AssignmentSearch, c: Constraint) -> List[int]:
+    """The levels of the search at which the variables a constraint reads are bound
+
+    Args:
+        search (AssignmentSearch): The search
+        c (Constraint): The constraint
+
+    Returns:
+        List[int]: The distinct levels, in increasing order
+    """
+    return sorted(set(search.levels[v] for v in c.variables()))
+
+
+def level_mask(c: Constraint, bindings: List[Dict[str, str]]) -> np.ndarray:
+    """Evaluate a constraint whose variables are all bound at the same level
+
+    Args:
+        c (Constraint): The constraint
+        bindings (List[Dict[str, str]]): The bindings at the level
+
+    Returns:
+        np.ndarray: A boolean mask over the domain of the level
+    """
+    return np.array([c.check(b) for b in bindings], dtype=bool)
+
+
+def pair_matrix(
+    search: AssignmentSearch,
+    c: Constraint,
+    bindings: List[List[Dict[str, str]]],
+) -> Tuple[int, int, np.ndarray]:
+    """Evaluate a constraint between variables bound at two different levels
+
+    Args:
+        search (AssignmentSearch): The search
+        c (Constraint): The constraint
+        bindings (List[List[Dict[str, str]]]): The bindings at every level
+
+    Returns:
+        Tuple[int, int, np.ndarray]: The two levels in increasing order, and the
+        compatibility matrix between their domains
+    """
+    c_levels = constraint_levels(search, c)
+    if not isinstance(c, BinaryConstraint) or len(c_levels) != 2:
+        raise Exception(f"Cannot make a compatibility matrix for {c.constraint_name}")
+
+    first, second = c_levels
+    mine = search.levels[c.variable_name]
+    theirs = search.levels[c.other_name]
+    matrix = c.matrix(
+        [b[c.variable_name] for b in bindings[mine]],
+        [b[c.other_name] for b in bindings[theirs]],
+    )
+    if mine != first:
+        matrix = matrix.T
+    return first, second, matrix
+
+
+def allowed_values(
+    block: np.ndarray, mask: np.ndarray, matrices: List[Tuple[int, np.ndarray]]
+) -> np.ndarray:
+    """Find the values of the next variable that are compatible with each of a block
+    of partial assignments
+
+    Args:
+        block (np.ndarray): The partial assignments, one per row
+        mask (np.ndarray): The mask of the next variable
+        matrices (List[Tuple[int, np.ndarray]]): The compatibility matrices between
+            the columns of the partial assignments and the next variable
+
+    Returns:
+        np.ndarray: A boolean matrix with a row for each partial assignment and a
+        column for each value of the next variable
+    """
+    allowed = np.repeat(mask[np.newaxis, :], len(block), axis=0)
+    for other, matrix in matrices:
+        allowed &= matrix[block[:, other]]
+    return allowed
+
+
+def extend_rows(
+    partial: np.ndarray,
+    masks: List[np.ndarray],
+    matrices: List[List[Tuple[int, np.ndarray]]],
+    batch_size: int,
+    lower: Optional[List[int]] = None,
+    upper: Optional[List[int]] = None,
+) -> Iterator[np.ndarray]:
+    """Extend partial assignments, one variable at a time, with every value that the
+    masks and the compatibility matrices allow
+
+    Args:
+        partial (np.ndarray): The partial assignments, one per row
+        masks (List[np.ndarray]): The masks of the variables to add, in order
+        matrices (List[List[Tuple[int, np.ndarray]]]): For each variable to add, the
+            compatibility matrices with the columns of the partial assignment that
+            it is constrained by
+        batch_size (int): The approximate number of candidates examined at once
+        lower (Optional[List[int]], optional): If given, only assignments that are
+            not lexicographically smaller than this one are produced
+        upper (Optional[List[int]], optional): If given, only assignments that are
+            not lexicographically larger than this one are produced
+
+    Yields:
+        np.ndarray: Arrays of complete assignments, in the order of the product of
+        the domains if the partial assignments are in that order
+    """
+    column = partial.shape[1]
+    if column == len(masks):
+        yield partial
+        return
+
+    mask = masks[column]
+    step = max(1, batch_size // max(1, len(mask)))
+    for start in range(0, len(partial), step):
+        block = partial[start : start + step]
+        allowed = allowed_values(block, mask, matrices[column])
+
+        # Partial assignments that agree with a bound so far can not go past it
+        if lower is not None:
+            on_lower = np.all(block == lower[:column], axis=1)
+            allowed[on_lower, : lower[column]] = False
+        if upper is not None:
+            on_upper = np.all(block == upper[:column], axis=1)
+            allowed[on_upper, upper[column] + 1 :] = False
+
+        # np.nonzero returns the pairs in row major order, which keeps the
+        # rows sorted in the order of the product of the domains
+        rows, candidates = np.nonzero(allowed)
+        if len(rows) > 0:
+            extended = np.column_stack((block[rows], candidates))
+            yield from extend_rows(extended, masks, matrices, batch_size, lower, upper)
+
+
+class CompatibilityJoin:
+    """A compatibility join finds the assignments that satisfy the constraints of a
+    template group by working with indices into the realized domains.
+
+    Every binary constraint between two independent variables (or variables that
+    depend on them) is evaluated once, over the two realized domains, into a
+    boolean compatibility matrix. Constraints that only involve a single independent
+    variable become a mask over its domain. Valid assignments are then produced by
+    extending arrays of partial assignments one variable at a time, keeping only the
+    extensions that every relevant matrix allows.
+    """
+
+    search: AssignmentSearch
+    bindings: List[List[Dict[str, str]]]
+    masks: List[np.ndarray]
+    matrices: List[List[Tuple[int, np.ndarray]]]
+
+    def __init__(self, search: AssignmentSearch) -> None:
+        self.search = search
+        depth = len(search.variables)
+        self.bindings = [search.bindings(level) for level in range(depth)]
+
+        self.masks = [np.ones(len(values), dtype=bool) for values in search.values]
+        pairs: List[Dict[int, np.ndarray]] = [{} for _ in range(depth)]
+        for level in range(depth):
+            for c in search.checks[level]:
+                if len(constraint_levels(search, c)) == 1:
+                    self.masks[level] &= level_mask(c, self.bindings[level])
+                else:
+                    first, second, matrix = pair_matrix(search, c, self.bindings)
+                    if first in pairs[second]:
+                        matrix = pairs[second][first] & matrix
+                    pairs[second][first] = matrix
+
+        self.matrices = [list(p.items()) for p in pairs]
+
+    def index_arrays(
+        self, batch_size: int = 1 << 16, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[np.ndarray]:
+        """Enumerate the valid assignments as arrays of indices
+
+        Args:
+            batch_size (int, optional): The approximate number of candidates that are
+                                        examined at once. Defaults to 65536.
+            start (int, optional): Only consider combinations of fillers whose index
+                                   in the product space is at least this.
+                                   Defaults to 0.
+            stop (Optional[int], optional): Only consider combinations of fillers
+                                            whose index is less than this. Defaults
+                                            to None, for the end of the space.
+
+        Yields:
+            np.ndarray: Arrays whose rows are valid assignments. Column i contains
+            the index into the realized domain of the i-th independent variable.
+        """
+        space = self.search.space
+        stop = space.size if stop is None else min(stop, space.size)
+        start = max(start, 0)
+        if start >= stop:
+            return
+
+        lower = space.decode(start)
+        upper = space.decode(stop - 1)
+        partial = np.zeros((1, 0), dtype=np.intp)
+        yield from extend_rows(
+            partial, self.masks, self.matrices, batch_size, lower, upper
+        )
+
+    def assignments(
+        self, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[Dict[str, str]]:
+        """Enumerate all the assignments that satisfy the constraints, in the same
+        order as the search would produce them
+
+        Args:
+            start (int, optional): The first index in the product space to consider.
+                                   Defaults to 0.
+            stop (Optional[int], optional): The index at which to stop. Defaults to
+                                            None, for the end of the space.
+
+        Yields:
+            Dict[str, str]: The values of all the variables
+        """
+        for array in self.index_arrays(start=start, stop=stop):
+            for row in array.tolist():
+                fillers: Dict[str, str] = {}
+                for level, index in enumerate(row):
+                    fillers.update(self.bindings[level][index])
+                yield fillers
@@ -1,9 +1,16 @@
-import itertools
-import json
-from typing import Dict, Iterable, List, Tuple
+import random
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Deque, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 
+import numpy as np
+
+from madlibs.compiled import TemplateCache
 from madlibs.core import FillerType
+from madlibs.count import count_assignments
+from madlibs.dedup import DedupStore, dedup_key, make_dedup_store
 from madlibs.group import MadLibTemplateGroup
+from madlibs.permutation import IndexPermutation
 
 
 class MadLibs:
@@ -13,39 +20,485 @@ class MadLibs:
         self,
         templates: Dict[str, str],
         fillers: Dict[str, List[FillerType]],
+        cache: Optional[TemplateCache] = None,
     ) -> None:
-        self.templates = MadLibTemplateGroup(templates, fillers)
-
-    def __populate_domains(self) -> List[List[Tuple[str, str]]]:
-        independent_domains = self.templates.realize_independent_domains()
-        fillers = []
-        for variable_name in independent_domains:
-            variable_fillers = []
-            for value in independent_domains[variable_name]:
-                variable_fillers.append((variable_name, value))
-            fillers.append(variable_fillers)
-        return fillers
-
-    def generate(self) -> Iterable[Tuple[Dict[str, str], Dict[str, str]]]:
-        fillers = self.__populate_domains()
-
-        all_options = itertools.product(*fillers)
-        seen = set()
-
-        for parameters in all_options:
-            independent_fillers = {}
-            for item in parameters:
-                independent_fillers[item[0]] = item[1]
-
-            params_dict = self.templates.realize_dependent_domains(independent_fillers)
-
-            rendered = self.templates.render(params_dict)
-
-            # rendered will be None if a constraint in the template is not satisfied
-            # by this filler
-            if rendered is not None:
-                relevant_params, generated = rendered
-                identifier = hash(json.dumps(relevant_params))
-                if identifier not in seen:
-                    seen.add(identifier)
-                    yield relevant_params, generated
+        """Build the template group
+
+        Args:
+            templates (Dict[str, str]): The templates of the group, by name
+            fillers (Dict[str, List[FillerType]]): The fillers, by type
+            cache (Optional[TemplateCache], optional): The cache that parses and
+                compiles the templates. Pass the same cache to every MadLibs that
+                is built at once. Defaults to None, for a new cache.
+        """
+        self.templates = MadLibTemplateGroup(templates, fillers, cache)
+
+    def __len__(self) -> int:
+        """The number of combinations of fillers for the independent variables,
+        without considering the constraints. Valid combinations are a subset of these.
+        """
+        return len(self.templates.search().space)
+
+    def __getitem__(
+        self, index: int
+    ) -> Optional[Tuple[Dict[str, str], Dict[str, str]]]:
+        """Render a single combination of fillers
+
+        Combinations are numbered in the order in which generate visits them, so
+        the valid ones among them come out of generate in increasing order.
+
+        Args:
+            index (int): The number of the combination. Negative numbers count from
+                         the end.
+
+        Raises:
+            IndexError: If the index is out of range
+
+        Returns:
+            Optional[Tuple[Dict[str, str], Dict[str, str]]]: The values of the
+            variables and the generated texts, or None if the combination violates
+            a constraint
+        """
+        search = self.templates.search()
+        if index < 0:
+            index += len(search.space)
+
+        fillers = search.assignment(search.space.decode(index))
+        if fillers is None:
+            return None
+        return self.templates.render_assignment(fillers)
+
+    def index_of(self, params: Dict[str, str]) -> int:
+        """Find the number of the combination of fillers that the given values of the
+        variables belong to. This is the inverse of indexing.
+
+        Args:
+            params (Dict[str, str]): The values of the variables, like the ones
+                                     generate produces
+
+        Returns:
+            int: The number of the combination
+        """
+        search = self.templates.search()
+        return search.space.encode(search.digits(params))
+
+    def count(self) -> int:
+        """Count the items that generate would produce, without rendering them
+
+        Returns:
+            int: The number of valid combinations of fillers
+        """
+        return count_assignments(self.templates.search())
+
+    def __sample_enumerated(
+        self, n: int, available: int, rng: random.Random, replace: bool
+    ) -> List[Dict[str, str]]:
+        if replace:
+            chosen = rng.choices(range(available), k=n)
+        else:
+            chosen = rng.sample(range(available), n)
+        positions: Dict[int, List[int]] = {}
+        for i, p in enumerate(chosen):
+            positions.setdefault(p, []).append(i)
+        items: List[Dict[str, str]] = [{} for _ in chosen]
+        for position, fillers in enumerate(self.templates.search().assignments()):
+            for i in positions.get(position, []):
+                items[i] = fillers
+        return items
+
+    def sample(
+        self, n: int, seed: Optional[int] = None, replace: bool = False
+    ) -> Iterable[Tuple[Dict[str, str], Dict[str, str]]]:
+        """Draw items uniformly at random from the ones that generate would produce
+
+        Combinations of fillers are drawn at random from the product of the domains
+        and the ones that violate a constraint are rejected. When that would take
+        more draws than there are valid items, because few combinations are valid
+        or more than half of the valid items are needed without replacement, the
+        valid items are enumerated instead.
+
+        Args:
+            n (int): The number of items to draw
+            seed (Optional[int], optional): The seed of the random number generator.
+                                            Defaults to None.
+            replace (bool, optional): Whether an item can be drawn more than once.
+                                      Defaults to False.
+
+        Yields:
+            Tuple[Dict[str, str], Dict[str, str]]: The values of the variables, and
+            the texts generated from each template
+        """
+        rng = random.Random(seed)
+        search = self.templates.search()
+        available = self.count()
+        if n > 0 and available == 0:
+            raise Exception("There are no items to sample from")
+        if not replace and n > available:
+            raise Exception(f"Cannot draw {n} distinct items out of {available}")
+
+        # Rejection takes n * size / available draws on average
+        draws = n * search.space.size
+        if draws >= available * available or (not replace and 2 * n > available):
+            for fillers in self.__sample_enumerated(n, available, rng, replace):
+                yield self.templates.render_assignment(fillers)
+            return
+
+        # Only the indices that are drawn without replacement need to be kept
+        drawn = set()
+        remaining = n
+        while remaining > 0:
+            index = rng.randrange(search.space.size)
+            if index in drawn:
+                continue
+
+            assignment = search.assignment(search.space.decode(index))
+            if assignment is not None:
+                if not replace:
+                    drawn.add(index)
+                remaining -= 1
+                yield self.templates.render_assignment(assignment)
+
+    def __shuffled(
+        self, seed: Optional[int], start: int, stop: Optional[int]
+    ) -> Iterable[Tuple[List[int], Dict[str, str]]]:
+        search = self.templates.search()
+        permutation = IndexPermutation(search.space.size, seed)
+        stop = search.space.size if stop is None else min(stop, search.space.size)
+        for position in range(max(start, 0), stop):
+            digits = search.space.decode(permutation[position])
+            fillers = search.assignment(digits)
+            if fillers is not None:
+                yield digits, fillers
+
+    def __check_method(self, method: str, order: str) -> None:
+        if method not in ["backtrack", "matrix"]:
+            raise Exception(f"Unknown generation method {method}")
+        if order not in ["sequential", "shuffled"]:
+            raise Exception(f"Unknown generation order {order}")
+        if order == "shuffled" and method != "backtrack":
+            raise Exception(f"The {method} method cannot shuffle its output")
+
+    def assignments(
+        self,
+        method: str = "backtrack",
+        order: str = "sequential",
+        seed: Optional[int] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> Iterable[Dict[str, str]]:
+        """Find the combinations of fillers that satisfy all the constraints, without
+        rendering them. The arguments are the same as for generate.
+
+        Args:
+            start (int, optional): Only consider combinations whose position in the
+                                   order of the product space is at least this. For
+                                   the shuffled order, this is the position in the
+                                   shuffled sequence. Defaults to 0.
+            stop (Optional[int], optional): Only consider combinations before this
+                                            position. Defaults to None, for the end
+                                            of the space.
+
+        Yields:
+            Dict[str, str]: The values of all the variables
+        """
+        self.__check_method(method, order)
+        if order == "shuffled":
+            return (fillers for _, fillers in self.__shuffled(seed, start, stop))
+        elif method == "backtrack":
+            return self.templates.search().assignments(start, stop)
+        else:
+            return self.templates.compatibility_join().assignments(start, stop)
+
+    def index_tuples(
+        self,
+        method: str = "backtrack",
+        order: str = "sequential",
+        seed: Optional[int] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> Iterable[Tuple[int, ...]]:
+        """Find the combinations of fillers that satisfy all the constraints, as the
+        positions of the fillers of the independent variables in their domains. The
+        arguments are the same as for assignments.
+
+        Yields:
+            Tuple[int, ...]: The positions of the fillers, in the order of the
+            independent variables of the search
+        """
+        self.__check_method(method, order)
+        if order == "shuffled":
+            return (tuple(d) for d, _ in self.__shuffled(seed, start, stop))
+        elif method == "backtrack":
+            return self.templates.search().index_tuples(start, stop)
+        else:
+            join = self.templates.compatibility_join()
+            arrays = join.index_arrays(start=start, stop=stop)
+            return (tuple(row) for array in arrays for row in array.tolist())
+
+    def index_arrays(
+        self,
+        method: str = "backtrack",
+        order: str = "sequential",
+        seed: Optional[int] = None,
+        start: int = 0,
+        stop: Optional[int] = None,
+    ) -> Iterable[np.ndarray]:
+        """Find the combinations of fillers that satisfy all the constraints, as
+        arrays of positions. The arguments are the same as for assignments.
+
+        Yields:
+            np.ndarray: Arrays with a row for each combination, and a column for
+            each independent variable
+        """
+        self.__check_method(method, order)
+        if method == "matrix":
+            join = self.templates.compatibility_join()
+            return join.index_arrays(start=start, stop=stop)
+        depth = len(self.templates.search().variables)
+        return _batched(self.index_tuples(method, order, seed, start, stop), depth)
+
+    def decode(self, indices: Iterable[int]) -> Tuple[Dict[str, str], Dict[str, str]]:
+        """Render a combination of fillers given by its positions, like the ones
+        that generate produces when its output is "indices" or "arrays". The
+        constraints are not checked.
+
+        Args:
+            indices (Iterable[int]): The positions of the fillers of the independent
+                                     variables in their domains
+
+        Returns:
+            Tuple[Dict[str, str], Dict[str, str]]: The values of the variables, and
+            the texts generated from each template
+        """
+        fillers = self.templates.search().decode(tuple(indices))
+        return self.templates.render_assignment(fillers)
+
+    def shard_range(self, shard: int, num_shards: int) -> Tuple[int, int]:
+        """Find the positions in the product space that belong to a shard. The shards
+        split the space into contiguous ranges of nearly equal sizes.
+
+        Args:
+            shard (int): The shard, between 0 and num_shards - 1
+            num_shards (int): The number of shards
+
+        Returns:
+            Tuple[int, int]: The first position of the shard, and the position after
+            its last one
+        """
+        if num_shards < 1 or shard < 0 or shard >= num_shards:
+            raise Exception(f"Invalid shard {shard} of {num_shards}")
+
+        size = self.templates.search().space.size
+        return shard * size // num_shards, (shard + 1) * size // num_shards
+
+    def __parallel_chunks(
+        self, workers: int, first: int, last: int
+    ) -> List[Tuple[int, int]]:
+        # A few chunks per worker, whatever the size of the space, so that sparse
+        # spaces do not pay for many chunks with nothing in them. Chunks end at a
+        # value of the first variable, so they do not split its subtrees.
+        space = self.templates.search().space
+        if first >= last:
+            return []
+        stride = space.size // space.radices[0] if len(space.radices) > 0 else 1
+        span = -(-(last - first) // (PARALLEL_CHUNKS_PER_WORKER * workers))
+        span = -(-span // stride) * stride
+        starts = [first]
+        starts.extend(range((first // span + 1) * span, last, span))
+        return [(start, min((start // span + 1) * span, last)) for start in starts]
+
+    def __generate_parallel(
+        self,
+        workers: int,
+        method: str,
+        order: str,
+        seed: Optional[int],
+        first: int,
+        last: int,
+        output: str,
+    ) -> Iterable[Any]:
+        # Workers get a pickled copy of the templates, without the Jinja objects.
+        # Chunks are submitted a few at a time and collected in order, so the
+        # output is the same as a serial run.
+        pending: Deque[Future] = deque()
+        with ProcessPoolExecutor(
+            workers, initializer=_start_worker, initargs=(self,)
+        ) as executor:
+            try:
+                for start, stop in self.__parallel_chunks(workers, first, last):
+                    pending.append(
+                        executor.submit(
+                            _generate_range, method, order, seed, start, stop, output
+                        )
+                    )
+                    if len(pending) >= 2 * workers:
+                        yield from pending.popleft().result()
+                while len(pending) > 0:
+                    yield from pending.popleft().result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def __deduplicated(
+        self,
+        rendered: Iterable[Tuple[Dict[str, str], Dict[str, str]]],
+        dedup: Union[str, DedupStore],
+        error_rate: Optional[float],
+        capacity: Optional[int],
+    ) -> Iterable[Tuple[Dict[str, str], Dict[str, str]]]:
+        if dedup != "bloom" and (error_rate is not None or capacity is not None):
+            raise Exception("Only the bloom dedup store has an error rate or capacity")
+
+        if isinstance(dedup, DedupStore):
+            store = dedup
+        elif dedup == "bloom":
+            # Without a capacity, size the filter for the most items that can come
+            # out
+            if capacity is None:
+                capacity = max(1, self.count())
+            kwargs: Dict[str, Any] = {"capacity": capacity}
+            if error_rate is not None:
+                kwargs["error_rate"] = error_rate
+            store = make_dedup_store(dedup, **kwargs)
+        else:
+            store = make_dedup_store(dedup)
+
+        try:
+            for params, generated in rendered:
+                if store.add(dedup_key(generated)):
+                    yield params, generated
+        finally:
+            # Stores that are passed in belong to the caller
+            if store is not dedup:
+                store.close()
+
+    def generate(
+        self,
+        method: str = "backtrack",
+        order: str = "sequential",
+        seed: Optional[int] = None,
+        workers: int = 1,
+        shard: int = 0,
+        num_shards: int = 1,
+        dedup: Union[None, str, DedupStore] = None,
+        output: str = "items",
+        dedup_error_rate: Optional[float] = None,
+        dedup_capacity: Optional[int] = None,
+    ) -> Iterable[Any]:
+        """Generate all the distinct texts that can be produced from the templates
+
+        Args:
+            method (str, optional): How to find the assignments that satisfy the
+                constraints. Either "backtrack", which checks constraints while
+                assigning variables one at a time, or "matrix", which precomputes
+                pairwise compatibility matrices and joins them. The latter is much
+                faster for large numeric ranges. Defaults to "backtrack".
+            order (str, optional): Either "sequential", or "shuffled", which visits
+                every combination of fillers once in a pseudo-random order without
+                holding the output in memory. Shuffling only works with the
+                backtrack method. Defaults to "sequential".
+            seed (Optional[int], optional): The seed of the shuffled order. The same
+                seed always gives the same order. Defaults to None.
+            workers (int, optional): The number of processes that render the texts.
+                The output is the same for any number of workers. Defaults to 1.
+            shard (int, optional): Only generate this shard of the output. Every
+                combination of fillers belongs to exactly one shard, so the shards
+                can be generated independently and concatenated, in the order of
+                the shards, to get the full output. Defaults to 0.
+            num_shards (int, optional): The number of shards. Defaults to 1.
+            dedup (Union[None, str, DedupStore], optional): Drop items whose texts
+                repeat the texts of an earlier item. Items are compared by their
+                texts, not by the values of their variables, which never repeat.
+                Either "memory", which keeps a digest of every item in memory,
+                "disk", which keeps them in an SQLite file, "bloom", which uses a
+                Bloom filter that can also drop a few items that are not repeated,
+                or a DedupStore. Each shard is deduplicated on its own. Defaults to
+                None, for no deduplication.
+            output (str, optional): What to produce for each valid combination of
+                fillers. Either "items", for the values of the variables and the
+                texts, "indices", for a tuple with the positions of the fillers of
+                the independent variables in their domains, or "arrays", for NumPy
+                arrays of those positions with a row for each combination. Nothing
+                is rendered for the latter two, and decode renders them on demand.
+                Defaults to "items".
+            dedup_error_rate (Optional[float], optional): The probability that the
+                bloom store drops an item that is not repeated. Defaults to None,
+                for the default of BloomDedupStore.
+            dedup_capacity (Optional[int], optional): The number of items that the
+                bloom store is sized for. Defaults to None, for the number of items
+                that count finds, which takes a while for large groups.
+
+        Yields:
+            Tuple[Dict[str, str], Dict[str, str]]: The values of the variables, and
+            the texts generated from each template, or positions of fillers
+        """
+        if output not in ["items", "indices", "arrays"]:
+            raise Exception(f"Unknown output {output}")
+        if dedup is not None and output != "items":
+            raise Exception("Only items can be deduplicated")
+        if order == "shuffled" and seed is None:
+            # Every worker and every shard has to shuffle in the same way
+            if num_shards > 1:
+                raise Exception("Shuffled shards need a seed")
+            seed = random.getrandbits(64)
+
+        first, last = self.shard_range(shard, num_shards)
+        if workers > 1:
+            # Check the arguments here, instead of in every worker
+            self.__check_method(method, order)
+            rendered = self.__generate_parallel(
+                workers, method, order, seed, first, last, output
+            )
+            if output == "arrays":
+                depth = len(self.templates.search().variables)
+                rendered = _batched(rendered, depth)
+        elif output == "indices":
+            rendered = self.index_tuples(method, order, seed, first, last)
+        elif output == "arrays":
+            rendered = self.index_arrays(method, order, seed, first, last)
+        else:
+            assignments = self.assignments(method, order, seed, first, last)
+            rendered = map(self.templates.render_assignment, assignments)
+
+        # Every assignment is distinct, since the domains do not repeat fillers, but
+        # different assignments can still produce the same texts
+        if dedup is None:
+            yield from rendered
+        else:
+            yield from self.__deduplicated(
+                rendered, dedup, dedup_error_rate, dedup_capacity
+            )
+
+
+# The number of chunks that the output is split into for each worker
+PARALLEL_CHUNKS_PER_WORKER = 4
+
+_worker_madlibs: Optional[MadLibs] = None
+
+
+def _start_worker(madlibs: MadLibs) -> None:
+    global _worker_madlibs
+    _worker_madlibs = madlibs
+
+
+def _generate_range(
+    method: str, order: str, seed: Optional[int], start: int, stop: int, output: str
+) -> List[Any]:
+    assert _worker_madlibs is not None  # noqa: S101
+    if output != "items":
+        return list(_worker_madlibs.index_tuples(method, order, seed, start, stop))
+    assignments = _worker_madlibs.assignments(method, order, seed, start, stop)
+    return list(map(_worker_madlibs.templates.render_assignment, assignments))
+
+
+def _batched(
+    tuples: Iterable[Tuple[int, ...]], depth: int, batch_size: int = 1 << 16
+) -> Iterator[np.ndarray]:
+    batch: List[Tuple[int, ...]] = []
+    for t in tuples:
+        batch.append(t)
+        if len(batch) == batch_size:
+            yield np.array(batch, dtype=np.intp).reshape(len(batch), depth)
+            batch = []
+    if len(batch) > 0:
+        yield np.array(batch, dtype=np.intp).reshape(len(batch), depth)
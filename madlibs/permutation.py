@@ -0,0 +1,76 @@
+import random
+from typing import Iterator, List, Optional
+
+
+class IndexPermutation:
+    """A seeded pseudo-random permutation of the numbers 0, 1, ..., size - 1 that
+    uses a constant amount of memory, however large the size is.
+
+    Numbers are shuffled by a balanced Feistel network over the smallest even number
+    of bits that can represent all of them. A Feistel network is a bijection on its
+    bits, but it can map a number in the range to one outside it. Such numbers are
+    passed through the network again until they land in the range (cycle walking).
+    Since the network covers less than four times the size, this takes fewer than
+    four passes on average.
+    """
+
+    size: int
+    half_bits: int
+    mask: int
+    keys: List[int]
+
+    def __init__(self, size: int, seed: Optional[int] = None, rounds: int = 6) -> None:
+        """Make a new permutation
+
+        Args:
+            size (int): The number of elements to permute
+            seed (Optional[int], optional): The seed for the permutation. The same
+                                            seed always gives the same permutation.
+                                            Defaults to None.
+            rounds (int, optional): The number of Feistel rounds. Defaults to 6.
+        """
+        self.size = size
+        self.half_bits = max(1, ((size - 1).bit_length() + 1) // 2)
+        self.mask = (1 << self.half_bits) - 1
+        rng = random.Random(seed)
+        self.keys = [rng.getrandbits(self.half_bits) for _ in range(rounds)]
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __round(self, value: int, key: int) -> int:
+        # A cheap integer hash that mixes all the bits of the half
+        value = ((value ^ key) * 0x9E3779B97F4A7C15) & self.mask
+        value ^= value >> ((self.half_bits + 1) // 2)
+        return ((value * 0xBF58476D1CE4E5B9) + key) & self.mask
+
+    def __encrypt(self, value: int) -> int:
+        left = value >> self.half_bits
+        right = value & self.mask
+        for key in self.keys:
+            left, right = right, left ^ self.__round(right, key)
+        return (left << self.half_bits) | right
+
+    def __getitem__(self, position: int) -> int:
+        """Find the number at a position of the permutation
+
+        Args:
+            position (int): The position
+
+        Raises:
+            IndexError: If the position is out of range
+
+        Returns:
+            int: The number at that position
+        """
+        if position < 0 or position >= self.size:
+            raise IndexError(f"Position {position} is out of range")
+
+        value = self.__encrypt(position)
+        while value >= self.size:
+            value = self.__encrypt(value)
+        return value
+
+    def __iter__(self) -> Iterator[int]:
+        for position in range(self.size):
+            yield self[position]
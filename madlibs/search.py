@@ -0,0 +1,490 @@
+from bisect import bisect_left
+from typing import Dict, Hashable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from madlibs.constraints import (
+    Constraint,
+    EqualityConstraint,
+    GreaterThanConstraint,
+    InequalityConstraint,
+    LessThanConstraint,
+    equality_key,
+)
+from madlibs.domains import DependentDomain, Domain, RangeValues
+from madlibs.space import ProductSpace
+
+
+class AssignmentSearch:
+    """An assignment search enumerates the joint assignments to the variables of a
+    template group that satisfy all the constraints of the group.
+
+    Independent variables are assigned one at a time, in the order of their realized
+    domains. A dependent variable is bound as soon as its parents are, and every
+    constraint is checked as soon as all the variables it reads are bound. Partial
+    assignments that violate a constraint are never extended, so entire subtrees of
+    the product of the domains are skipped. The assignments that are found come out
+    in the same order as a product over the independent domains would produce them.
+
+    The assignments to the independent variables are numbered by a product space
+    over their domains. The domains should not repeat fillers, so that every
+    assignment is distinct.
+
+    An equals constraint between an independent variable and a variable bound
+    before it fixes the value of the former, so only the positions of its domain
+    with an equal filler are visited. A not_equals constraint of the same kind
+    skips the positions with an equal filler, without checking the others. Both
+    are found by looking up the filler in an index of the domain, so chains of
+    equals and cliques of not_equals cost time in proportion to the assignments
+    they allow, not to the product of the domains.
+
+    The domains of range variables are not listed. A less_than or greater_than
+    constraint between a range variable and a variable bound before it bounds the
+    positions of the range, which are found by arithmetic, so only the values
+    between the bounds are visited.
+    """
+
+    variables: List[str]
+    values: List[Sequence[str]]
+    positions: List[Optional[Dict[str, int]]]
+    space: ProductSpace
+    levels: Dict[str, int]
+    dependents: List[List[Tuple[str, DependentDomain]]]
+    tables: List[Optional[List[Dict[str, str]]]]
+    checks: List[List[Constraint]]
+    equal_to: List[List[str]]
+    not_equal_to: List[List[str]]
+    less_than: List[List[str]]
+    greater_than: List[List[str]]
+    residual_checks: List[List[Constraint]]
+    __indices: List[Optional[Dict[Hashable, List[int]]]]
+
+    def __init__(
+        self,
+        independent_domains: Dict[str, Sequence[str]],
+        domains: Dict[str, Domain],
+        constraints: Dict[str, List[Constraint]],
+    ) -> None:
+        """Prepare a search over the given domains
+
+        Args:
+            independent_domains (Dict[str, Sequence[str]]): The realized domains of the
+                independent variables, in the order in which they are assigned
+            domains (Dict[str, Domain]): The domains of all the variables
+            constraints (Dict[str, List[Constraint]]): The constraints on each variable
+        """
+        self.variables = list(independent_domains)
+        self.values = []
+        self.positions = []
+        for variable in self.variables:
+            values = independent_domains[variable]
+            self.values.append(values)
+            # Ranges never repeat a value, and find their positions themselves
+            if isinstance(values, RangeValues):
+                self.positions.append(None)
+                continue
+            positions = {value: i for i, value in enumerate(values)}
+            if len(positions) != len(values):
+                raise Exception(f"Repeated fillers in the domain of {variable}")
+            self.positions.append(positions)
+        self.space = ProductSpace([len(values) for values in self.values])
+        self.dependents = [[] for _ in self.variables]
+        self.checks = [[] for _ in self.variables]
+
+        self.levels = {}
+        for level, variable in enumerate(self.variables):
+            self.levels[variable] = level
+
+        for variable in domains:
+            self.__find_level(variable, domains, set())
+
+        for variable in constraints:
+            for c in constraints[variable]:
+                for name in c.variables():
+                    if name not in self.levels:
+                        raise Exception(
+                            f"Unknown variable {name} in {c.constraint_name}"
+                        )
+                level = max(self.levels[name] for name in c.variables())
+                self.checks[level].append(c)
+
+        self.tables = self.__make_tables()
+        self.__split_checks()
+
+    def __split_checks(self) -> None:
+        # Equality constraints between the variable of a level and a variable that
+        # is bound before it are handled by looking up the allowed positions, and so
+        # are ordered constraints if the variable of the level is a range
+        self.equal_to = [[] for _ in self.variables]
+        self.not_equal_to = [[] for _ in self.variables]
+        self.less_than = [[] for _ in self.variables]
+        self.greater_than = [[] for _ in self.variables]
+        self.residual_checks = [[] for _ in self.variables]
+        self.__indices = [None for _ in self.variables]
+        for level, variable in enumerate(self.variables):
+            is_range = isinstance(self.values[level], RangeValues)
+            for c in self.checks[level]:
+                other = self.__earlier_variable(level, c)
+                ordered = isinstance(c, (LessThanConstraint, GreaterThanConstraint))
+                if other is None:
+                    self.residual_checks[level].append(c)
+                elif isinstance(c, EqualityConstraint):
+                    self.equal_to[level].append(other)
+                elif isinstance(c, InequalityConstraint):
+                    self.not_equal_to[level].append(other)
+                elif is_range and ordered:
+                    # The constraint compares its variable to its other variable
+                    less = isinstance(c, LessThanConstraint)
+                    if (c.variable_name == variable) == less:
+                        self.less_than[level].append(other)
+                    else:
+                        self.greater_than[level].append(other)
+                else:
+                    self.residual_checks[level].append(c)
+
+    def __earlier_variable(self, level: int, c: Constraint) -> Optional[str]:
+        # The other variable of a binary constraint on the variable of a level, if
+        # it is bound at an earlier level
+        variable = self.variables[level]
+        names = c.variables()
+        others = [name for name in names if name != variable]
+        if len(names) != 2 or len(others) != 1 or variable not in names:
+            return None
+        if self.levels[others[0]] >= level:
+            return None
+        return others[0]
+
+    def __index(self, level: int) -> Dict[Hashable, List[int]]:
+        # The positions in the domain of a level, by their equality key
+        index = self.__indices[level]
+        if index is None:
+            index = {}
+            for position, value in enumerate(self.values[level]):
+                key = equality_key(value)
+                if key is not None:
+                    index.setdefault(key, []).append(position)
+            self.__indices[level] = index
+        return index
+
+    def __make_tables(self) -> List[Optional[List[Dict[str, str]]]]:
+        # Levels with dependents that only depend on the variable of the level look
+        # up all the values they bind in one table, instead of computing them. If a
+        # filler lacks a dependent, the error is left for when it is bound.
+        self.tables = [None for _ in self.variables]
+        for level in range(len(self.variables)):
+            if len(self.dependents[level]) > 0 and self.__is_local(level):
+                try:
+                    self.tables[level] = self.bindings(level)
+                except KeyError:
+                    pass
+        return self.tables
+
+    def __find_level(
+        self, variable: str, domains: Dict[str, Domain], visiting: Set[str]
+    ) -> int:
+        # A dependent variable is bound at the level of its last parent
+        if variable in self.levels:
+            return self.levels[variable]
+
+        domain = domains.get(variable)
+        if not isinstance(domain, DependentDomain) or variable in visiting:
+            raise Exception(f"Cannot determine the value of {variable}")
+
+        visiting.add(variable)
+        level = max(
+            self.__find_level(parent, domains, visiting)
+            for parent in domain.parent_names
+        )
+        self.levels[variable] = level
+        self.dependents[level].append((variable, domain))
+        return level
+
+    def __is_local(self, level: int) -> bool:
+        for _, domain in self.dependents[level]:
+            for parent in domain.parent_names:
+                if self.levels[parent] != level:
+                    return False
+        return True
+
+    def __set(self, level: int, position: int, fillers: Dict[str, str]) -> None:
+        table = self.tables[level]
+        if table is not None:
+            fillers.update(table[position])
+        else:
+            fillers[self.variables[level]] = self.values[level][position]
+            for variable, domain in self.dependents[level]:
+                fillers[variable] = domain.value(fillers)
+
+    def __bind(
+        self,
+        level: int,
+        position: int,
+        fillers: Dict[str, str],
+        checks: List[List[Constraint]],
+    ) -> bool:
+        self.__set(level, position, fillers)
+
+        for c in checks[level]:
+            if not c.check(fillers):
+                return False
+        return True
+
+    def __equal_positions(self, level: int, value: str) -> Sequence[int]:
+        # The positions in the domain of a level with a filler equal to a value
+        key = equality_key(value)
+        if key is None:
+            return []
+        values = self.values[level]
+        if isinstance(values, RangeValues):
+            if not isinstance(key, float):
+                return []
+            return range(values.bisect_left(key), values.bisect_right(key))
+        return self.__index(level).get(key, [])
+
+    def __bounds(
+        self, level: int, fillers: Dict[str, str], low: int, high: int
+    ) -> Tuple[int, int]:
+        # Narrow the positions of a range by its ordered constraints
+        values = self.values[level]
+        if not isinstance(values, RangeValues):
+            return low, high
+        for other in self.less_than[level]:
+            number = float(fillers[other])
+            high = min(high, values.bisect_left(number) if number == number else 0)
+        for other in self.greater_than[level]:
+            number = float(fillers[other])
+            low = max(low, values.bisect_right(number) if number == number else high)
+        return low, high
+
+    def __candidates(
+        self, level: int, fillers: Dict[str, str], low: int, high: int
+    ) -> Tuple[Sequence[int], Set[int]]:
+        # The positions between low and high that the equality and ordered
+        # constraints of the level allow, and the positions that its inequality
+        # constraints exclude
+        low, high = self.__bounds(level, fillers, low, high)
+        candidates: Sequence[int] = range(low, max(low, high))
+        for other in self.equal_to[level]:
+            allowed = self.__equal_positions(level, fillers[other])
+            if isinstance(candidates, range):
+                first = bisect_left(allowed, candidates.start)
+                candidates = allowed[first : bisect_left(allowed, candidates.stop)]
+            else:
+                kept = set(allowed)
+                candidates = [p for p in candidates if p in kept]
+
+        excluded: Set[int] = set()
+        for other in self.not_equal_to[level]:
+            excluded.update(self.__equal_positions(level, fillers[other]))
+        return candidates, excluded
+
+    def bindings(self, level: int) -> List[Dict[str, str]]:
+        """Find the values of all the variables that are bound at a level, for each
+        value of the independent variable at that level
+
+        Args:
+            level (int): The level
+
+        Raises:
+            Exception: If a variable at this level depends on variables bound at
+                       other levels
+
+        Returns:
+            List[Dict[str, str]]: One assignment per value in the domain. These can
+            be shared with the search, and should not be changed.
+        """
+        if not self.__is_local(level):
+            raise Exception("A variable depends on more than one independent variable")
+
+        table = self.tables[level]
+        if table is not None:
+            return table
+
+        output = []
+        for value in self.values[level]:
+            fillers = {self.variables[level]: value}
+            for variable, domain in self.dependents[level]:
+                fillers[variable] = domain.value(fillers)
+            output.append(fillers)
+        return output
+
+    def assignment(self, digits: List[int]) -> Optional[Dict[str, str]]:
+        """Find the assignment that corresponds to an element of the product space
+
+        Args:
+            digits (List[int]): The positions of the values of the independent
+                                variables in their domains
+
+        Returns:
+            Optional[Dict[str, str]]: The values of all the variables, or None if the
+            assignment violates a constraint
+        """
+        fillers: Dict[str, str] = {}
+        for level, position in enumerate(digits):
+            if not self.__bind(level, position, fillers, self.checks):
+                return None
+        return fillers
+
+    def digits(self, fillers: Dict[str, str]) -> List[int]:
+        """Find the element of the product space that corresponds to an assignment
+
+        Args:
+            fillers (Dict[str, str]): The values of the independent variables. Any
+                                      other variables are ignored.
+
+        Returns:
+            List[int]: The positions of the values in their domains
+        """
+        output = []
+        for level, variable in enumerate(self.variables):
+            if variable not in fillers:
+                raise Exception(f"Missing filler for variable {variable}")
+            value = fillers[variable]
+            position = self.__position(level, value)
+            if position is None:
+                raise Exception(f"{value} is not in the domain of {variable}")
+            output.append(position)
+        return output
+
+    def complete(self, fillers: Dict[str, str]) -> Dict[str, str]:
+        """Find the values of all the variables from the values of the independent
+        variables, without checking the constraints. Unlike decode, the values do
+        not have to be in the domains of their variables.
+
+        Args:
+            fillers (Dict[str, str]): The values of the independent variables. Any
+                                      other variables are ignored.
+
+        Returns:
+            Dict[str, str]: The values of all the variables
+        """
+        output: Dict[str, str] = {}
+        for level, variable in enumerate(self.variables):
+            value = fillers[variable]
+            table = self.tables[level]
+            position = None if table is None else self.__position(level, value)
+            if table is not None and position is not None:
+                output.update(table[position])
+                continue
+            output[variable] = value
+            for name, domain in self.dependents[level]:
+                output[name] = domain.value(output)
+        return output
+
+    def __position(self, level: int, value: str) -> Optional[int]:
+        values = self.values[level]
+        if isinstance(values, RangeValues):
+            return values.position(value)
+        return self.positions[level].get(value)  # type: ignore
+
+    def decode(self, digits: Tuple[int, ...]) -> Dict[str, str]:
+        """Find the values of all the variables for an element of the product space,
+        without checking the constraints
+
+        Args:
+            digits (Tuple[int, ...]): The positions of the values of the independent
+                                      variables in their domains, like the ones that
+                                      index_tuples produces
+
+        Returns:
+            Dict[str, str]: The values of all the variables
+        """
+        fillers: Dict[str, str] = {}
+        for level, position in enumerate(digits):
+            self.__set(level, position, fillers)
+        return fillers
+
+    def __walk(
+        self, start: int, stop: Optional[int]
+    ) -> Iterator[Tuple[List[int], Dict[str, str]]]:
+        # Yields the positions and the values of the variables of every valid
+        # assignment. Both are changed in place as the search goes on.
+        stop = self.space.size if stop is None else min(stop, self.space.size)
+        start = max(start, 0)
+        if start >= stop:
+            return
+
+        depth = len(self.variables)
+        fillers: Dict[str, str] = {}
+        if depth == 0:
+            yield [], fillers
+            return
+
+        # Only the subtrees along the paths to the first and the last combination
+        # in the range are cut short. Everything between them is fully explored.
+        lower = self.space.decode(start)
+        upper = self.space.decode(stop - 1)
+        on_lower = [True] * depth
+        on_upper = [True] * depth
+        positions = list(lower)
+        candidates: List[Sequence[int]] = [[] for _ in range(depth)]
+        excluded: List[Set[int]] = [set() for _ in range(depth)]
+        cursors = [0] * depth
+
+        level = 0
+        while level >= 0:
+            if cursors[level] == 0:
+                low = lower[level] if on_lower[level] else 0
+                high = upper[level] + 1 if on_upper[level] else len(self.values[level])
+                found = self.__candidates(level, fillers, low, high)
+                candidates[level], excluded[level] = found
+
+            if cursors[level] >= len(candidates[level]):
+                # This level is exhausted, so backtrack to the previous one
+                cursors[level] = 0
+                level -= 1
+                if level >= 0:
+                    cursors[level] += 1
+                continue
+
+            position = candidates[level][cursors[level]]
+            positions[level] = position
+            if position in excluded[level] or not self.__bind(
+                level, position, fillers, self.residual_checks
+            ):
+                cursors[level] += 1
+            elif level == depth - 1:
+                yield positions, fillers
+                cursors[level] += 1
+            else:
+                level += 1
+                on_lower[level] = on_lower[level - 1] and position == lower[level - 1]
+                on_upper[level] = on_upper[level - 1] and position == upper[level - 1]
+
+    def assignments(
+        self, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[Dict[str, str]]:
+        """Enumerate all the assignments that satisfy the constraints
+
+        Args:
+            start (int, optional): Only consider combinations of fillers whose index
+                                   in the product space is at least this.
+                                   Defaults to 0.
+            stop (Optional[int], optional): Only consider combinations of fillers
+                                            whose index is less than this. Defaults
+                                            to None, for the end of the space.
+
+        Yields:
+            Dict[str, str]: The values of all the variables, both independent and
+            dependent ones
+        """
+        for _, fillers in self.__walk(start, stop):
+            yield dict(fillers)
+
+    def index_tuples(
+        self, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[Tuple[int, ...]]:
+        """Enumerate all the assignments that satisfy the constraints, as the
+        positions of the values of the independent variables in their domains. These
+        are much smaller than the assignments themselves, and decode turns them back
+        into assignments.
+
+        Args:
+            start (int, optional): The first index in the product space to consider.
+                                   Defaults to 0.
+            stop (Optional[int], optional): The index at which to stop. Defaults to
+                                            None, for the end of the space.
+
+        Yields:
+            Tuple[int, ...]: The positions, one for each independent variable
+        """
+        for positions, _ in self.__walk(start, stop):
+            yield tuple(positions)
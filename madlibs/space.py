@@ -0,0 +1,63 @@
+from functools import reduce
+from typing import List
+
+
+class ProductSpace:
+    """A product space numbers the elements of a product of finite sets. Each element
+    is a list of digits, one per set, and the digits are read as a mixed-radix
+    number whose radices are the sizes of the sets. The last digit changes fastest,
+    so the numbering follows the order of itertools.product.
+    """
+
+    radices: List[int]
+    size: int
+
+    def __init__(self, radices: List[int]) -> None:
+        self.radices = list(radices)
+        self.size = reduce(lambda a, b: a * b, self.radices, 1)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def decode(self, index: int) -> List[int]:
+        """Find the digits of an element of this space
+
+        Args:
+            index (int): The number of the element
+
+        Raises:
+            IndexError: If the index is not in this space
+
+        Returns:
+            List[int]: The digits, one for each set
+        """
+        if index < 0 or index >= self.size:
+            raise IndexError(f"Index {index} is out of range")
+
+        digits = [0] * len(self.radices)
+        for i in reversed(range(len(self.radices))):
+            index, digits[i] = divmod(index, self.radices[i])
+        return digits
+
+    def encode(self, digits: List[int]) -> int:
+        """Find the number of an element of this space
+
+        Args:
+            digits (List[int]): The digits, one for each set
+
+        Raises:
+            IndexError: If the digits do not describe an element of this space
+
+        Returns:
+            int: The number of the element
+        """
+        if len(digits) != len(self.radices):
+            raise IndexError(f"Expected {len(self.radices)} digits")
+
+        index = 0
+        for i, radix in enumerate(self.radices):
+            digit = digits[i]
+            if digit < 0 or digit >= radix:
+                raise IndexError(f"Digit {digit} is out of range")
+            index = index * radix + digit
+        return index
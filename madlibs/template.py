@@ -1,23 +1,44 @@
-from typing import Dict, List, Optional, Set, Tuple
+from typing import Any, Dict, List, Optional, Set, Tuple
 
 import jinja2.nodes as jnodes
-from jinja2 import Environment, Template, meta
+from jinja2 import Template, meta
 
-from madlibs.constraints import Constraint, make_constraint, register_known_constraints
+from madlibs.compiled import CompiledTemplate, TemplateCache
+from madlibs.constraints import Constraint, make_constraint
 from madlibs.core import FillerType
 from madlibs.domains import (
+    CollectedDependents,
     Domain,
     FillerDependentDomain,
     make_domain,
     make_filler_domain,
-    register_known_domains,
     try_unify,
 )
 
 
 class MadLibTemplate:
-    template: Template
+    """A MadLibTemplate is a Jinja template whose variables are drawn from domains of
+    fillers, subject to the constraints written as filters in the template.
+
+    Templates that only print variables, possibly through filters that do not need
+    Jinja's context, are compiled into literal segments and variable slots and
+    rendered without Jinja. Other templates are rendered by Jinja.
+
+    Templates are parsed and compiled through a template cache, which should be
+    shared by all the templates that are built together.
+
+    A template only depends on its own variables, which can be a few of the
+    variables of its group. render_memoized keeps the texts it renders, by the
+    values of those variables, so that combinations of fillers that only differ
+    in other variables reuse them.
+    """
+
+    source: str
+    cache: TemplateCache
+    __memo: Dict[Any, str]
+    compiled: Optional[CompiledTemplate]
     variables: Set[str]
+    variable_order: List[str]
     constraints: Dict[str, List[Constraint]]
     domains: Dict[str, Domain]
 
@@ -26,27 +47,45 @@ class MadLibTemplate:
         template: str,
         fillers: Dict[str, List[FillerType]],
         collected_dependents: Dict[str, Domain] = None,
+        cache: Optional[TemplateCache] = None,
     ) -> None:
-        env = Environment(autoescape=True)
-        register_known_domains(env)
-        register_known_constraints(env)
-
-        self.template = env.from_string(template)
+        self.source = template
+        self.cache = TemplateCache() if cache is None else cache
         self.domains = {}
         self.constraints = {}
 
-        ast = env.parse(template)
+        ast = self.cache.parse(template)
+        self.compiled = self.cache.compile(template)
         self.variables = meta.find_undeclared_variables(ast)
+        self.variable_order = []
 
         if collected_dependents is None:
-            collected_dependents = {}
+            collected_dependents = CollectedDependents()
         self.__collect_constraints(ast, fillers, collected_dependents)
+        self.__memo = {}
 
         # At this point, every variable should have a domain
         for v in self.variables:
             if v not in self.domains:
                 raise Exception(f"Missing domain for {v}")
 
+    def __getstate__(self) -> Dict[str, Any]:
+        # The cache is shared with other templates, so it is left out. Only the
+        # compiled template is needed to render, and Jinja is set up again if a
+        # template needs it.
+        state = dict(self.__dict__)
+        del state["cache"]
+        state["_MadLibTemplate__memo"] = {}
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.cache = TemplateCache()
+
+    @property
+    def template(self) -> Template:
+        return self.cache.jinja_template(self.source)
+
     def __walk_filter_node(
         self,
         node: jnodes.Filter,
@@ -124,6 +163,7 @@ class MadLibTemplate:
 
                         self.__update_dependents(collected_dependents, domains[1:])
                         self.constraints[name] = []
+                        self.__add_to_order(name)
                     elif isinstance(node, jnodes.Filter):
                         name = node.name  # type: ignore
 
@@ -143,9 +183,15 @@ class MadLibTemplate:
                             self.domains[name] = try_unify(self.domains[name], domain)
                         self.__update_dependents(collected_dependents, dependents)
                         self.constraints[name] = constraints
+                        self.__add_to_order(name)
             else:
                 raise Exception(f"Expecting output, found {output}")
 
+    def __add_to_order(self, name: str) -> None:
+        # Variables are ordered by their first appearance in the template
+        if name not in self.variable_order:
+            self.variable_order.append(name)
+
     def __update_dependents(
         self, collected_dependents: Dict[str, Domain], dependents: List[Domain]
     ) -> None:
@@ -153,15 +199,7 @@ class MadLibTemplate:
             v = d.variable_name
             if v not in collected_dependents:
                 # only add something as a dependent if it is not a parent already
-                is_parent = False
-                for name in collected_dependents:
-                    dep = collected_dependents[name]
-                    if isinstance(dep, FillerDependentDomain):
-                        if v == dep.parent.variable_name:
-                            is_parent = True
-                            break
-
-                if not is_parent:
+                if not self.__is_parent(collected_dependents, v):
                     collected_dependents[v] = d
             else:
                 unified = collected_dependents[v].unify_with(d)
@@ -171,6 +209,17 @@ class MadLibTemplate:
                         f"{other_type} cannot be unified with {d.variable_type}"
                     )
 
+    def __is_parent(self, collected_dependents: Dict[str, Domain], v: str) -> bool:
+        if isinstance(collected_dependents, CollectedDependents):
+            return v in collected_dependents.parents
+
+        for name in collected_dependents:
+            dep = collected_dependents[name]
+            if isinstance(dep, FillerDependentDomain):
+                if v == dep.parent.variable_name:
+                    return True
+        return False
+
     def __try_reconcile_with_collected_dependent(
         self,
         variable_name: str,
@@ -190,4 +239,31 @@ class MadLibTemplate:
         for v in self.variables:
             if v not in fillers:
                 raise Exception(f"Missing filler for variable {v}")
+        if self.compiled is not None:
+            return self.compiled.render(fillers)
         return self.template.render(**fillers)
+
+    def render_memoized(self, fillers: Dict[str, str]) -> str:
+        """Render the template, reusing the text if it has been rendered before with
+        the same values of its variables
+
+        Args:
+            fillers (Dict[str, str]): The values of the variables. Other variables
+                                      are ignored.
+
+        Returns:
+            str: The rendered text
+        """
+        key = tuple([fillers[v] for v in self.variable_order])
+        text = self.__memo.get(key)
+        if text is None:
+            # Only keep a bounded number of texts
+            if len(self.__memo) >= RENDER_MEMO_SIZE:
+                self.__memo.clear()
+            text = self.render(fillers)
+            self.__memo[key] = text
+        return text
+
+
+# The number of texts that each template keeps for render_memoized
+RENDER_MEMO_SIZE = 1 << 16
@@ -1,8 +1,25 @@
+import functools
+import hashlib
 import json
-from typing import Any, Dict
+import os
+import pickle  # noqa: S403
+import random
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Hashable, Iterator, List, Mapping, Optional, Tuple
 
+import jinja2
+
+from madlibs import __version__
+from madlibs.compiled import TemplateCache
+from madlibs.core import FillerType
+from madlibs.domains import FillerIndex, FillerValues
 from madlibs.madlibs import MadLibs
 
+# The file in each bundle directory that records the files it was built from
+BUNDLE_SOURCES = "sources.json"
+
 
 def read_fillers(fillers_file: str) -> Dict[Any, Any]:
     with open(fillers_file, "r") as f:
@@ -17,12 +34,333 @@ def read_templates(templates_file: str) -> Dict[str, Dict[str, str]]:
     return data
 
 
-def make_madlibs(fillers_file: str, templates_file: str) -> Dict[str, MadLibs]:
-    fillers = read_fillers(fillers_file)
-    templates = read_templates(templates_file)
+@functools.lru_cache(maxsize=None)
+def package_digest() -> str:
+    """Hash the sources of the package. Bundles are pickles of the objects of the
+    package, so they can only be read by the code that wrote them.
 
-    data = {}
-    for key in templates:
-        data[key] = MadLibs(templates[key], fillers)
+    Returns:
+        str: A hex digest of the source files of the package
+    """
+    directory = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha256()
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".py"):
+            with open(os.path.join(directory, name), "rb") as f:
+                contents = f.read()
+            digest.update(f"{name}\n".encode("utf-8"))
+            digest.update(hashlib.sha256(contents).digest())
+    return digest.hexdigest()
 
-    return data
+
+def bundle_key(fillers_file: str, templates_file: str) -> str:
+    """Make the key of the bundle built from a fillers file and a templates file. The
+    key changes whenever either file, the sources of the package or the version of
+    Jinja change.
+
+    Args:
+        fillers_file (str): The JSON file with the fillers
+        templates_file (str): The JSON file with the template groups
+
+    Returns:
+        str: A hex digest of the contents of the files and the versions
+    """
+    digest = hashlib.sha256()
+    versions = f"{__version__} {package_digest()} {jinja2.__version__}\n"
+    digest.update(versions.encode("utf-8"))
+    for path in [fillers_file, templates_file]:
+        with open(path, "rb") as f:
+            contents = f.read()
+        digest.update(hashlib.sha256(contents).digest())
+    return digest.hexdigest()
+
+
+def load_bundle(path: str) -> Optional[MadLibs]:
+    """Load a template group saved by save_bundle
+
+    Args:
+        path (str): The bundle file
+
+    Returns:
+        Optional[MadLibs]: The template group, or None if the bundle is missing, can
+        not be read, or was written by other code
+    """
+    try:
+        with open(path, "rb") as f:
+            bundle = pickle.load(f)  # noqa: S301
+    except Exception:
+        return None
+
+    # Groups pickled by other code may lack attributes that this code needs
+    if not isinstance(bundle, tuple) or len(bundle) != 2:
+        return None
+    digest, group = bundle
+    if digest != package_digest() or not isinstance(group, MadLibs):
+        return None
+    return group
+
+
+def save_bundle(path: str, group: MadLibs) -> None:
+    """Save a template group, with its analyzed domains, constraints and compiled
+    templates, so that it can be loaded without building it again
+
+    Args:
+        path (str): The bundle file
+        group (MadLibs): The template group
+    """
+    # Write to a temporary file and move it in place, so that processes that
+    # start at the same time never see a partial bundle
+    directory = os.path.dirname(os.path.abspath(path))
+    # The directory is removed if another process prunes it
+    os.makedirs(directory, exist_ok=True)
+    handle, temporary = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            bundle = (package_digest(), group)
+            pickle.dump(bundle, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+    except BaseException:
+        os.remove(temporary)
+        raise
+
+
+def prune_bundles(cache_dir: str, key: str, sources: Dict[str, str]) -> None:
+    """Remove the bundles that were built from the same files as a new bundle,
+    before they changed. Bundles of other files are kept.
+
+    Args:
+        cache_dir (str): The cache directory
+        key (str): The key of the new bundle
+        sources (Dict[str, str]): The files that the new bundle is built from, as
+                                  recorded in its directory
+    """
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name == key or not os.path.isdir(path):
+            continue
+        try:
+            with open(os.path.join(path, BUNDLE_SOURCES), "r") as f:
+                old_sources = json.load(f)
+        except Exception:
+            continue
+        if old_sources == sources:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class LazyMadLibs(Mapping[str, MadLibs]):
+    """A mapping from the names of the template groups in a templates file to the
+    groups, which builds each group the first time it is accessed. If there is a
+    cache directory, the groups that are built are saved there, and later loaded
+    from there as long as neither file changes.
+
+    Each set of bundles is kept in a directory named after its key, with a record
+    of the files it was built from. When the files change, the new bundles replace
+    the directories of the old ones.
+
+    Groups that are loaded or built in other processes are attached to the values
+    of the fillers and the template cache of the mapping, so that all the groups
+    share them like the ones built in this process do.
+    """
+
+    fillers_file: str
+    templates: Dict[str, Dict[str, str]]
+    bundle_dir: Optional[str]
+    groups: Dict[str, MadLibs]
+    __fillers: Optional[Dict[str, List[FillerType]]]
+    __cache: TemplateCache
+    __shared: Dict[str, FillerValues]
+
+    def __init__(
+        self, fillers_file: str, templates_file: str, cache_dir: Optional[str] = None
+    ) -> None:
+        self.fillers_file = fillers_file
+        self.templates = read_templates(templates_file)
+        self.bundle_dir = None
+        if cache_dir is not None:
+            key = bundle_key(fillers_file, templates_file)
+            self.bundle_dir = os.path.join(cache_dir, key)
+            if not os.path.isdir(self.bundle_dir):
+                os.makedirs(self.bundle_dir, exist_ok=True)
+                sources = {
+                    "fillers": os.path.abspath(fillers_file),
+                    "templates": os.path.abspath(templates_file),
+                }
+                with open(os.path.join(self.bundle_dir, BUNDLE_SOURCES), "w") as f:
+                    json.dump(sources, f)
+                prune_bundles(cache_dir, key, sources)
+
+        self.groups = {}
+        self.__fillers = None
+        # The groups share one environment, and templates that repeat across groups
+        # are only parsed once
+        self.__cache = TemplateCache()
+        self.__shared = {}
+
+    def __getitem__(self, name: str) -> MadLibs:
+        if name not in self.groups:
+            if name not in self.templates:
+                raise KeyError(name)
+
+            path = self.bundle_path(name)
+            group = None if path is None else load_bundle(path)
+            if group is None:
+                group = MadLibs(self.templates[name], self.fillers(), self.__cache)
+                if path is not None:
+                    save_bundle(path, group)
+            self.__attach(group)
+            self.groups[name] = group
+        return self.groups[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.templates)
+
+    def __len__(self) -> int:
+        return len(self.templates)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.templates
+
+    def fillers(self) -> Dict[str, List[FillerType]]:
+        # The fillers are only read if a group has to be built
+        if self.__fillers is None:
+            # Every group shares the values of each type of fillers
+            self.__fillers = FillerIndex(read_fillers(self.fillers_file))
+        return self.__fillers
+
+    def bundle_path(self, name: str) -> Optional[str]:
+        """The file in which a group is saved
+
+        Args:
+            name (str): The name of the group
+
+        Returns:
+            Optional[str]: The path of the file, or None if there is no cache
+            directory
+        """
+        if self.bundle_dir is None:
+            return None
+        digest = hashlib.sha256(name.encode("utf-8")).hexdigest()
+        return os.path.join(self.bundle_dir, f"{digest}.pickle")
+
+    def prebuild(self, workers: int = 1) -> None:
+        """Build all the groups that have not been built yet
+
+        Args:
+            workers (int, optional): The number of processes that build groups.
+                                     Defaults to 1.
+        """
+        missing = [name for name in self.templates if name not in self.groups]
+        if workers <= 1:
+            for name in missing:
+                self[name]
+            return
+
+        with ProcessPoolExecutor(
+            workers, initializer=_start_builder, initargs=(self,)
+        ) as executor:
+            built = executor.map(_build_group, missing)
+            for i, group in enumerate(built):
+                self.__attach(group)
+                self.groups[missing[i]] = group
+
+    def __attach(self, group: MadLibs) -> None:
+        group.templates.attach(self.__shared, self.__cache)
+
+    def generate(
+        self,
+        groups: Optional[List[str]] = None,
+        method: str = "backtrack",
+        order: str = "sequential",
+        seed: Optional[int] = None,
+        shard: int = 0,
+        num_shards: int = 1,
+    ) -> Iterator[Tuple[str, Dict[str, str], Dict[str, str]]]:
+        """Generate the texts of several groups. Groups with the same variables,
+        domains and constraints share one enumeration of their assignments, and
+        every assignment is rendered by each of them in turn, so the items of those
+        groups are interleaved. Other groups follow each other.
+
+        Only method, order, seed, shard and num_shards are supported, and they mean
+        the same as for MadLibs.generate. Use MadLibs.generate on each group for
+        workers, dedup or output.
+
+        Args:
+            groups (Optional[List[str]], optional): The groups to generate. Defaults
+                                                    to None, for all the groups.
+            method (str, optional): How to find the assignments. Defaults to
+                                    "backtrack".
+            order (str, optional): Either "sequential" or "shuffled". Defaults to
+                                   "sequential".
+            seed (Optional[int], optional): The seed of the shuffled order. Defaults
+                                            to None.
+            shard (int, optional): Only generate this shard of each group. Defaults
+                                   to 0.
+            num_shards (int, optional): The number of shards. Defaults to 1.
+
+        Yields:
+            Tuple[str, Dict[str, str], Dict[str, str]]: The name of the group, the
+            values of the variables, and the texts generated from each template
+        """
+        if order == "shuffled" and seed is None:
+            if num_shards > 1:
+                raise Exception("Shuffled shards need a seed")
+            seed = random.getrandbits(64)
+
+        names = list(self) if groups is None else groups
+        shared: Dict[Hashable, List[str]] = {}
+        for name in names:
+            shared.setdefault(self[name].templates.signature(), []).append(name)
+
+        for members in shared.values():
+            first = self[members[0]]
+            start, stop = first.shard_range(shard, num_shards)
+            renderers = [(name, self[name].templates) for name in members]
+            for fillers in first.assignments(method, order, seed, start, stop):
+                for name, group in renderers:
+                    params, generated = group.render_assignment(fillers)
+                    yield name, params, generated
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Workers that prebuild groups only need the sources
+        state = dict(self.__dict__)
+        state["groups"] = {}
+        del state["_LazyMadLibs__cache"]
+        state["_LazyMadLibs__shared"] = {}
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self.__cache = TemplateCache()
+
+
+def make_madlibs(
+    fillers_file: str, templates_file: str, cache_dir: Optional[str] = None
+) -> LazyMadLibs:
+    """Get the template groups in a templates file. Each group is built the first
+    time it is accessed.
+
+    Args:
+        fillers_file (str): The JSON file with the fillers
+        templates_file (str): The JSON file with the template groups
+        cache_dir (Optional[str], optional): A directory in which to keep the built
+            groups. They are loaded from there as long as neither file changes, and
+            replaced when either does. Defaults to None, for building the groups
+            every time.
+
+    Returns:
+        LazyMadLibs: The template groups, by name
+    """
+    return LazyMadLibs(fillers_file, templates_file, cache_dir)
+
+
+_builder_groups: Optional[LazyMadLibs] = None
+
+
+def _start_builder(groups: LazyMadLibs) -> None:
+    global _builder_groups
+    _builder_groups = groups
+
+
+def _build_group(name: str) -> MadLibs:
+    assert _builder_groups is not None  # noqa: S101
+    return _builder_groups[name]
@@ -0,0 +1,49 @@
+import json
+
+from madlibs.cli import main
+
+
+def read_lines(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_cli(tmp_path):
+    output = tmp_path / "all.jsonl"
+    main(["data/fillers.json", "data/templates.json", "--output", str(output)])
+    items = read_lines(output)
+    assert len(items) == 90
+    assert set(item["group"] for item in items) == {"group1", "group2"}
+
+    shards = []
+    for shard in range(3):
+        output = tmp_path / f"shard{shard}.jsonl"
+        main(
+            [
+                "data/fillers.json",
+                "data/templates.json",
+                "--group",
+                "group1",
+                "--shard",
+                str(shard),
+                "--num-shards",
+                "3",
+                "--output",
+                str(output),
+            ]
+        )
+        shards.extend(read_lines(output))
+
+    assert shards == [item for item in items if item["group"] == "group1"]
+
+
+def test_cli_dedup(tmp_path):
+    output = tmp_path / "dedup.jsonl"
+    args = ["data/fillers.json", "data/templates.json", "--output", str(output)]
+    main(args + ["--dedup", "memory"])
+    expected = read_lines(output)
+    main(
+        args
+        + ["--dedup", "bloom", "--dedup-error-rate", "1e-9", "--dedup-capacity", "100"]
+    )
+    assert read_lines(output) == expected
@@ -1,6 +1,7 @@
 import pytest
 
 from madlibs.constraints import make_constraint
+from madlibs.domains import FillerValues, RangeDomain
 
 
 def test_equality_constraint():
@@ -97,3 +98,51 @@ def test_greater_than_exceptions():
     with pytest.raises(Exception):
         c = make_constraint("greater_than", "a", "b")
         c.check({"b": "1"})
+
+
+def test_constraint_matrices():
+    values = ["1", "1.0", "2", "apple", "cat"]
+    for name in ["equals", "not_equals"]:
+        c = make_constraint(name, "a", "b")
+        m = c.matrix(values, values[::-1])
+        assert m.shape == (5, 5)
+        for i, a in enumerate(values):
+            for j, b in enumerate(values[::-1]):
+                assert m[i, j] == c.check({"a": a, "b": b})
+
+    numbers = ["1", "2.5", "3", "-1"]
+    for name in ["less_than", "greater_than"]:
+        c = make_constraint(name, "a", "b")
+        m = c.matrix(numbers, numbers[:2])
+        assert m.shape == (4, 2)
+        for i, a in enumerate(numbers):
+            for j, b in enumerate(numbers[:2]):
+                assert m[i, j] == c.check({"a": a, "b": b})
+
+
+def test_specialized_constraints():
+    values = FillerValues("x", ["1", "2.0", " 3", "nan"])
+    assert values.value_type == "number"
+    assert values.keys == {"1": 1.0, "2.0": 2.0, " 3": 3.0, "nan": values.keys["nan"]}
+    assert values.numbers["2.0"] == 2.0 and values.numbers["-1"] == -1.0
+    assert FillerValues("x", ["1", "one"]).value_type == "string"
+
+    fillers = ["1", "2", "1.0", "apple", "nan", " 2 "]
+    keys = FillerValues("x", fillers).keys
+    numbers = RangeDomain("y", 0, 3).number_parser()
+    for name in ["equals", "not_equals", "less_than", "greater_than"]:
+        generic = make_constraint(name, "a", "b")
+        typed = make_constraint(name, "a", "b")
+        typed.specialize({"b": numbers}, {"a": keys.__getitem__, "b": numbers})
+        for a in fillers:
+            for b in ["0", "1", "2"]:
+                try:
+                    expected = generic.check({"a": a, "b": b})
+                except ValueError:
+                    continue
+                assert typed.check({"a": a, "b": b}) == expected
+
+    # Fillers that were not parsed in advance are parsed when they are checked
+    c = make_constraint("less_than", "a", "b")
+    c.specialize({"a": values.numbers.__getitem__}, {})
+    assert c.check({"a": "-1", "b": "0"})
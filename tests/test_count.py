@@ -0,0 +1,125 @@
+import math
+
+from madlibs.count import count_assignments
+from madlibs.group import MadLibTemplateGroup
+from madlibs.madlibs import MadLibs
+
+
+def count_by_search(g):
+    return len(list(g.search().assignments()))
+
+
+def test_count_independent():
+    templates = {"s": '{{person}} likes {{x | type("object")}} and {{n | range(0, 7)}}'}
+    fillers = {"person": ["Jack", "Jill", "Jill"], "object": ["cake", "coffee"]}
+    g = MadLibTemplateGroup(templates, fillers)
+    assert count_assignments(g.search()) == 2 * 2 * 7
+
+
+def test_count_ordered():
+    templates = {
+        "s": "{{a | range(0, 30) | less_than('b') | greater_than('c')}} "
+        + "{{b | range(5, 25, 2)}} {{c | range(0, 30, 3)}} "
+        + "{{d | range(0, 5) | less_than('e')}} {{e | range(0, 5)}}"
+    }
+    g = MadLibTemplateGroup(templates, {})
+    assert count_assignments(g.search()) == count_by_search(g)
+
+    templates = {
+        "s": "{{a | range(0, 30) | less_than('b') | greater_than('b')}} "
+        + "{{b | range(5, 25, 2)}}"
+    }
+    g = MadLibTemplateGroup(templates, {})
+    assert count_assignments(g.search()) == 0
+
+
+def test_count_joined():
+    templates = {
+        "s": "{{a | range(0, 10) | not_equals('b')}} {{b | range(0, 10)}} "
+        + "{{c | range(0, 10) | greater_than('a') | less_than('b')}} "
+        + "{{d | range(0, 10) | equals('c')}}"
+    }
+    g = MadLibTemplateGroup(templates, {})
+    expected = count_by_search(g)
+    assert expected > 0
+    assert count_assignments(g.search()) == expected
+    assert count_assignments(g.search(), batch_size=3) == expected
+
+
+def test_count_with_dependents():
+    templates = {
+        "s": '{{name}} {{pronoun | not_equals("name")}} '
+        + '{{other | type("name") | not_equals("name")}} {{n | range(0, 3)}}'
+    }
+    fillers = {
+        "person": [
+            {"name": "Jack", "pronoun": "he"},
+            {"name": "Jill", "pronoun": "she"},
+            {"name": "Joe", "pronoun": "he"},
+        ],
+    }
+    g = MadLibTemplateGroup(templates, fillers)
+    assert count_assignments(g.search()) == count_by_search(g) == 18
+
+
+def test_madlibs_count():
+    s = (
+        "{{n | range(0, 5, 1)}} and {{m | range(1, 6, 1)}} are both "
+        + 'less than {{r | range(0, 7, 1) | greater_than("m") | greater_than("n")}}.'
+    )
+    m = MadLibs({"s": s}, {})
+    expected = len(list(m.generate()))
+
+    def fail(fillers):
+        raise Exception("count should not render")
+
+    m.templates.render_assignment = fail
+    assert m.count() == expected
+
+    assert MadLibs({"s": "Hello."}, {}).count() == 1
+    assert MadLibs({"s": "{{a}}"}, {"a": []}).count() == 0
+
+
+def test_count_equal():
+    templates = {
+        "s": "{{a | type('a')}} {{b | type('b') | not_equals('a')}} "
+        + "{{c | range(0, 5) | equals('d')}} {{d | range(0, 10, 0.5)}}"
+    }
+    fillers = {"a": ["1", "x", "nan", "2.0"], "b": ["1.0", "x", "nan", "3", "y"]}
+    g = MadLibTemplateGroup(templates, fillers)
+    assert count_assignments(g.search()) == count_by_search(g) == 18 * 5
+
+    g = MadLibTemplateGroup(
+        {"s": "{{a | range(0, 20000)}} {{b | range(0, 20000) | not_equals('a')}}"},
+        {},
+    )
+    assert count_assignments(g.search()) == 20000 * 19999
+
+
+def test_count_tree():
+    # A chain is counted without listing the pairs of its first variables
+    n = 3000
+    templates = {
+        "s": f"{{{{x | range(0, {n}) | greater_than('y')}}}} "
+        + f"{{{{y | range(0, {n}) | greater_than('z')}}}} {{{{z | range(0, {n})}}}}"
+    }
+    g = MadLibTemplateGroup(templates, {})
+    assert count_assignments(g.search()) == math.comb(n, 3)
+
+    # Counts that do not fit in 64 bits are exact
+    n = 10000
+    parts = [f"{{{{v{i} | range(0, {n}) | less_than('v{i + 1}')}}}}" for i in range(4)]
+    parts.append(f"{{{{v4 | range(0, {n})}}}}")
+    g = MadLibTemplateGroup({"s": " ".join(parts)}, {})
+    assert count_assignments(g.search()) == math.comb(n, 5)
+
+    # Trees with every kind of edge, and a cycle
+    templates = {
+        "s": "{{a | range(0, 8) | less_than('b') | not_equals('c')}} "
+        + "{{b | range(0, 10, 0.5)}} {{c | type('c') | equals('d')}} "
+        + "{{d | type('d')}} {{e | range(0, 4) | greater_than('b') | less_than('f')}} "
+        + "{{f | range(0, 6) | not_equals('b') | greater_than('a')}}"
+    }
+    fillers = {"c": ["1", "x", "nan", "2.0"], "d": ["1.0", "x", "nan", "3", "2"]}
+    g = MadLibTemplateGroup(templates, fillers)
+    assert count_assignments(g.search()) == count_by_search(g) > 0
@@ -0,0 +1,63 @@
+import os
+
+import pytest
+
+from madlibs.dedup import (
+    BloomDedupStore,
+    MemoryDedupStore,
+    SqliteDedupStore,
+    dedup_key,
+    make_dedup_store,
+)
+
+
+@pytest.mark.parametrize("name", ["memory", "disk"])
+def test_exact_stores(name):
+    store = make_dedup_store(name)
+    keys = [dedup_key({"s": str(i)}) for i in range(100)]
+    assert all(store.add(key) for key in keys)
+    assert not any(store.add(key) for key in keys)
+    assert store.memory_usage() > 0
+    store.close()
+
+
+def test_memory_store_usage_grows():
+    store = MemoryDedupStore()
+    empty = store.memory_usage()
+    for i in range(1000):
+        store.add(dedup_key({"s": str(i)}))
+    assert store.memory_usage() > empty
+
+
+def test_disk_store_file(tmp_path):
+    store = SqliteDedupStore()
+    path = store.path
+    assert os.path.exists(path)
+    store.close()
+    assert not os.path.exists(path)
+
+    path = str(tmp_path / "seen.sqlite")
+    store = SqliteDedupStore(path)
+    assert store.add(b"key")
+    store.close()
+
+    store = SqliteDedupStore(path)
+    assert not store.add(b"key")
+    store.close()
+    assert os.path.exists(path)
+
+
+def test_bloom_store():
+    store = BloomDedupStore(1000, error_rate=0.01)
+    memory = store.memory_usage()
+    keys = [dedup_key({"s": str(i)}) for i in range(1000)]
+    added = sum(store.add(key) for key in keys)
+    assert added > 970
+    assert not any(store.add(key) for key in keys)
+    assert store.memory_usage() == memory
+
+    with pytest.raises(Exception):
+        BloomDedupStore(1000, error_rate=0)
+
+    with pytest.raises(Exception):
+        make_dedup_store("unknown")
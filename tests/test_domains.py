@@ -1,8 +1,11 @@
 import pytest
 
 from madlibs.domains import (
+    CollectedDependents,
     FillerDependentDomain,
     FillerDomain,
+    FillerIndex,
+    FillerValues,
     RangeDomain,
     make_filler_domain,
     make_range_domain,
@@ -271,3 +274,142 @@ def test_dependent_domain_unification():
     for a in failures:
         assert d1.unify_with(a) is None
         assert a.unify_with(d1) is None
+
+
+def test_filler_domain_repeated_values():
+    f = FillerDomain("x", "x", ["Jack", "Jill", "Jack", "Joe", "Jill"])
+    assert f.values == ["Jack", "Jill", "Joe"]
+    assert f.generate_domain() == ["Jack", "Jill", "Joe"]
+
+    f = FillerDomain(
+        "x",
+        "name",
+        [
+            {"name": "Jack", "pronoun": "he"},
+            {"name": "Jill", "pronoun": "she"},
+            {"name": "Jack", "pronoun": "they"},
+        ],
+    )
+    assert f.values == ["Jack", "Jill"]
+    assert f.lookup_dependent("Jack", "pronoun") == "they"
+
+
+def test_filler_index_shares_values():
+    fillers = FillerIndex(
+        {
+            "person": [
+                {"name": "Jack", "pronoun": "he"},
+                {"name": "Jill", "pronoun": "she"},
+            ],
+            "location": ["Germany", "Nairobi"],
+        }
+    )
+    a = make_filler_domain("x", fillers, "location")[0]
+    b = make_filler_domain("y", fillers, "location")[0]
+    assert a.variable_name == "x" and b.variable_name == "y"
+    assert a.values is b.values
+
+    c = make_filler_domain("x", fillers, "name")
+    d = make_filler_domain("y", fillers, "name")
+    assert c[0].values is d[0].values
+    assert c[0].fillers is d[0].fillers
+    assert c[1].value({"y": "Jill", "x": "Jack"}) == "he"
+
+    # Plain dictionaries still give fresh values
+    e = make_filler_domain("x", dict(fillers), "location")[0]
+    assert e.values == a.values and e.values is not a.values
+
+
+def test_filler_index_fields():
+    fillers = FillerIndex(
+        {
+            "empty": [],
+            "location": ["Germany", "Nairobi"],
+            "person": [{"name": "Jack", "pronoun": "he"}],
+            "pet": [{"name": "Rex", "species": "dog"}],
+        }
+    )
+    assert fillers.field_key("name") == "person"
+    assert fillers.field_key("species") == "pet"
+    assert fillers.field_key("location") is None
+    assert make_filler_domain("x", fillers, "species")[0].values == ["dog"]
+
+    with pytest.raises(Exception):
+        make_filler_domain("x", fillers, "age")
+
+
+def test_collected_dependents():
+    parent = FillerDomain("x", "name", [{"name": "Jack", "pronoun": "he"}])
+    collected = CollectedDependents()
+    collected["pronoun"] = FillerDependentDomain("pronoun", parent)
+    collected["y"] = FillerDomain("y", "y", ["a"])
+    assert collected.parents == {"x"}
+
+
+def test_filler_values_columns():
+    values = FillerValues(
+        "name",
+        [
+            {"name": "Jack", "pronoun": "he"},
+            {"name": "Jill", "pronoun": "she", "pet": "Rex"},
+            {"name": "Jack", "pronoun": "they"},
+        ],
+    )
+    assert values.values == ["Jack", "Jill"]
+    assert values.codes == {"Jack": 0, "Jill": 1}
+    assert values.columns == {"pronoun": ["they", "she"], "pet": [None, "Rex"]}
+    assert values.lookup(1, "pet") == "Rex"
+    assert values.dependents == {
+        "Jack": {"pronoun": "they"},
+        "Jill": {"pronoun": "she", "pet": "Rex"},
+    }
+
+    with pytest.raises(KeyError):
+        values.lookup(0, "pet")
+
+    with pytest.raises(Exception):
+        FillerValues("name", [{"name": "Jack", "pronoun": "he"}, "Jill"])
+
+
+def test_range_values():
+    values = RangeDomain("x", 0.1, 0.5, 0.1).realize()
+    assert len(values) == 4
+    assert list(values) == [values[i] for i in range(4)]
+    assert values[-1] == values[3] and values[1:3] == list(values)[1:3]
+    with pytest.raises(IndexError):
+        values[4]
+
+    values = RangeDomain("x", 2, 20, 3).realize()
+    assert list(values) == ["2", "5", "8", "11", "14", "17"]
+    assert values.bisect_left(8) == 2 and values.bisect_right(8) == 3
+    assert values.bisect_left(8.5) == 3 and values.bisect_right(8.5) == 3
+    assert values.bisect_left(-1) == 0 and values.bisect_right(100) == 6
+    assert values.bisect_left(float("inf")) == 6
+    assert values.position("11") == 3
+    assert values.position("11.0") is None and values.position("12") is None
+    assert values.position("nan") is None and values.position("a") is None
+
+    # Fractional ranges print the values that adding the step over and over gives
+    for start, end, step in [(0, 1, 0.1), (0, 2, 0.5), (0.1, 0.5, 0.1), (0, 300, 0.1)]:
+        expected = []
+        n = start
+        while n < end:
+            expected.append(str(n))
+            n += step
+        r = RangeDomain("x", start, end, step)
+        assert r.generate_domain() == expected
+        values = r.realize()
+        assert [values[i] for i in range(len(values))] == expected
+        for i in [0, 3, len(expected) - 1]:
+            assert values.position(expected[i]) == i
+    assert RangeDomain("x", 0, 1, 0.1).generate_domain()[:4] == [
+        "0",
+        "0.1",
+        "0.2",
+        "0.30000000000000004",
+    ]
+
+    assert len(RangeDomain("x", 5, 1).realize()) == 0
+    assert len(RangeDomain("x", 0, 10**9).realize()) == 10**9
+    with pytest.raises(Exception):
+        RangeDomain("x", 1, 5, 0).realize()
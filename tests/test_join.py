@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from madlibs.group import MadLibTemplateGroup
+
+
+def test_join_matches_search():
+    templates = {
+        "s": "{{a | range(0, 6) | less_than('b')}} {{b | range(0, 6)}} "
+        + "{{c | range(0, 4) | not_equals('a') | greater_than('b')}}"
+    }
+    g = MadLibTemplateGroup(templates, {})
+    expected = list(g.search().assignments())
+    assert len(expected) > 0
+    assert list(g.compatibility_join().assignments()) == expected
+
+
+def test_join_with_dependents():
+    templates = {
+        "s": '{{name}} {{pronoun | not_equals("name")}} '
+        + '{{other | type("name") | not_equals("name")}}'
+    }
+    fillers = {
+        "person": [
+            {"name": "Jack", "pronoun": "he"},
+            {"name": "Jill", "pronoun": "she"},
+            {"name": "Joe", "pronoun": "he"},
+        ],
+    }
+    g = MadLibTemplateGroup(templates, fillers)
+    expected = list(g.search().assignments())
+    assert len(expected) == 6
+    assert list(g.compatibility_join().assignments()) == expected
+
+
+def test_join_index_arrays():
+    templates = {"s": "{{a | range(0, 50) | less_than('b')}} {{b | range(0, 50)}}"}
+    g = MadLibTemplateGroup(templates, {})
+    join = g.compatibility_join()
+    assert g.compatibility_join() is join
+    a = join.search.variables.index("a")
+    b = join.search.variables.index("b")
+
+    # small batches should not change the order of the rows
+    arrays = list(join.index_arrays(batch_size=7))
+    assert len(arrays) > 1
+    rows = np.concatenate(arrays)
+    assert len(rows) == 50 * 49 // 2
+    assert np.all(rows[:, a] < rows[:, b])
+    assert rows.tolist() == np.concatenate(list(join.index_arrays())).tolist()
+    assert rows.tolist() == sorted(rows.tolist())
+
+
+def test_join_exceptions():
+    templates = {"s": "{{a | range(0, 3) | less_than('b')}} {{b}}"}
+    g = MadLibTemplateGroup(templates, {"b": ["x", "y"]})
+    with pytest.raises(Exception):
+        g.compatibility_join()
@@ -1,7 +1,14 @@
+import json
+import os
+import pickle
+import subprocess
+import sys
+
 import pytest
 
+from madlibs.dedup import MemoryDedupStore
 from madlibs.madlibs import MadLibs
-from madlibs.utils import make_madlibs
+from madlibs.utils import load_bundle, make_madlibs
 
 
 def test_generate():
@@ -40,6 +47,35 @@ def test_generate_unique():
         assert text["s1"] == f"{params['person']} likes {params['object']}."
 
 
+def test_generate_dedup():
+    template = {"s1": "{{person | first}} likes {{object}}."}
+
+    fillers = {
+        "object": ["cake", "coffee"],
+        "person": ["Jack", "Jill"],
+    }
+    m = MadLibs(template, fillers)
+    assert len(list(m.generate())) == 4
+
+    for dedup in ["memory", "disk", "bloom"]:
+        texts = [generated["s1"] for _, generated in m.generate(dedup=dedup)]
+        assert texts == ["J likes cake.", "J likes coffee."]
+
+    store = MemoryDedupStore()
+    assert len(list(m.generate(dedup=store))) == 2
+    assert len(list(m.generate(dedup=store))) == 0
+
+    # The bloom store can be sized without counting the items
+    def fail():
+        raise Exception("dedup should not count")
+
+    m.count = fail
+    items = m.generate(dedup="bloom", dedup_error_rate=1e-3, dedup_capacity=10)
+    assert len(list(items)) == 2
+    with pytest.raises(Exception):
+        list(m.generate(dedup="memory", dedup_error_rate=1e-3))
+
+
 def test_generate_from_dictionary():
     template = {"s1": "{{name}} likes {{object}}. {{pronoun | title}} does."}
 
@@ -81,6 +117,44 @@ def test_from_file():
         assert text["s1"] == f"{n} likes {o}. {p} does."
 
 
+def test_from_file_cached(tmp_path):
+    fillers_file = tmp_path / "fillers.json"
+    templates_file = tmp_path / "templates.json"
+    fillers_file.write_text(open("data/test_fillers.json").read())
+    templates_file.write_text(open("data/test_templates.json").read())
+    cache_dir = str(tmp_path / "cache")
+
+    built = make_madlibs(str(fillers_file), str(templates_file), cache_dir)
+    loaded = make_madlibs(str(fillers_file), str(templates_file), cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    assert list(loaded) == list(built)
+    assert list(loaded["group1"].generate()) == list(built["group1"].generate())
+
+    # Bundles of other files are kept
+    other_file = tmp_path / "other.json"
+    other_file.write_text(json.dumps({"group1": {"s1": "{{object}}!"}}))
+    other = make_madlibs(str(fillers_file), str(other_file), cache_dir)
+    other["group1"]
+    assert len(os.listdir(cache_dir)) == 2
+
+    # Changing either file invalidates the bundle, and removes it
+    templates_file.write_text(json.dumps({"group1": {"s1": "{{object}}"}}))
+    changed = make_madlibs(str(fillers_file), str(templates_file), cache_dir)
+    assert sorted(os.listdir(cache_dir)) == sorted(
+        [os.path.basename(changed.bundle_dir), os.path.basename(other.bundle_dir)]
+    )
+    assert len(list(changed["group1"].generate())) == 2
+
+    # Bundles written by other code are rebuilt
+    path = changed.bundle_path("group1")
+    with open(path, "wb") as f:
+        pickle.dump(("other code", changed["group1"]), f)
+    assert load_bundle(path) is None
+    rebuilt = make_madlibs(str(fillers_file), str(templates_file), cache_dir)
+    assert len(list(rebuilt["group1"].generate())) == 2
+    assert load_bundle(path) is not None
+
+
 def test_filler_constraints():
     s1 = '{{person}} is a {{n | range(2, 10, 2)}}-time {{x | type("profession")}}.'
     s2 = '{{person}} is a {{m | range(1, 9, 2)}}-time {{x | type("profession") | title}}.'
@@ -270,3 +344,280 @@ def test_generate_with_dependents():
     assert len(sentences) == 2
     assert "Jack he" in sentences
     assert "Jill she" in sentences
+
+
+def test_generate_methods():
+    s = (
+        "{{n | range(0, 5, 1)}} and {{m | range(1, 6, 1)}} are both "
+        + 'less than {{r | range(0, 7, 1) | greater_than("m") | greater_than("n")}}.'
+    )
+    m = MadLibs({"s": s}, {})
+    assert list(m.generate(method="matrix")) == list(m.generate())
+
+    with pytest.raises(Exception):
+        list(m.generate(method="unknown"))
+
+
+def test_random_access():
+    s = (
+        '{{n | range(0, 5, 1) | less_than("m")}} and {{m | range(1, 6, 1)}} '
+        + "with {{person}}"
+    )
+    m = MadLibs({"s": s}, {"person": ["Jack", "Jill", "Jill"]})
+    assert len(m) == 5 * 5 * 2
+
+    items = [m[i] for i in range(len(m))]
+    valid = [item for item in items if item is not None]
+    assert valid == list(m.generate())
+    assert m[-1] == items[-1]
+
+    for i, item in enumerate(items):
+        if item is not None:
+            assert m.index_of(item[0]) == i
+
+    with pytest.raises(IndexError):
+        m[len(m)]
+
+    with pytest.raises(Exception):
+        m.index_of({"n": "0", "m": "1", "person": "Joe"})
+
+    with pytest.raises(Exception):
+        m.index_of({"n": "0", "m": "1"})
+
+
+def test_sample():
+    s = '{{n | range(0, 20, 1) | less_than("m")}} and {{m | range(0, 20, 1)}}'
+    m = MadLibs({"s": s}, {})
+    everything = list(m.generate())
+    assert len(everything) == 190
+
+    for n in [5, 150, 190]:
+        items = list(m.sample(n, seed=1))
+        assert len(items) == n
+        assert len(set(item[1]["s"] for item in items)) == n
+        for item in items:
+            assert item in everything
+
+    assert list(m.sample(5, seed=2)) == list(m.sample(5, seed=2))
+
+    items = list(m.sample(500, seed=3, replace=True))
+    assert len(items) == 500
+    for item in items:
+        assert int(item[0]["n"]) < int(item[0]["m"])
+
+    with pytest.raises(Exception):
+        list(m.sample(191))
+
+
+def test_sample_uniform():
+    s = '{{n | range(0, 4, 1) | less_than("m")}} and {{m | range(0, 4, 1)}}'
+    m = MadLibs({"s": s}, {})
+    counts = {}
+    for item in m.sample(6000, seed=0, replace=True):
+        counts[item[1]["s"]] = counts.get(item[1]["s"], 0) + 1
+
+    assert len(counts) == 6
+    for c in counts.values():
+        assert 800 < c < 1200
+
+
+def test_sample_sparse():
+    s = '{{a | range(0, 20000)}} {{b | range(0, 20000) | equals("a")}}'
+    m = MadLibs({"s": s}, {})
+    for replace in [False, True]:
+        items = list(m.sample(200, seed=4, replace=replace))
+        assert len(items) == 200
+        assert all(item[0]["a"] == item[0]["b"] for item in items)
+    assert len(set(item[1]["s"] for item in m.sample(200, seed=4))) == 200
+
+    # Dense spaces are still sampled by rejection
+    s = '{{n | range(0, 20, 1) | less_than("m")}} and {{m | range(0, 20, 1)}}'
+    items = list(MadLibs({"s": s}, {}).sample(3, seed=1, replace=True))
+    assert all(int(item[0]["n"]) < int(item[0]["m"]) for item in items)
+
+
+def test_generate_shuffled():
+    s = '{{n | range(0, 10, 1) | less_than("m")}} and {{m | range(0, 10, 1)}}'
+    m = MadLibs({"s": s}, {"x": ["a"]})
+    expected = list(m.generate())
+    shuffled = list(m.generate(order="shuffled", seed=5))
+    assert shuffled != expected
+    assert sorted(shuffled, key=lambda i: i[1]["s"]) == sorted(
+        expected, key=lambda i: i[1]["s"]
+    )
+    assert list(m.generate(order="shuffled", seed=5)) == shuffled
+
+    with pytest.raises(Exception):
+        list(m.generate(method="matrix", order="shuffled"))
+
+    with pytest.raises(Exception):
+        list(m.generate(order="unknown"))
+
+
+def test_generate_parallel():
+    s = (
+        '{{n | range(0, 30, 1) | less_than("m")}} and {{m | range(0, 30, 1)}} '
+        + "with {{person}}"
+    )
+    m = MadLibs({"s": s}, {"person": ["Jack", "Jill", "Jill"]})
+    expected = list(m.generate())
+    assert list(m.generate(workers=3)) == expected
+    assert list(m.generate(method="matrix", workers=2)) == expected
+
+    shuffled = list(m.generate(order="shuffled", seed=3))
+    assert list(m.generate(order="shuffled", seed=3, workers=2)) == shuffled
+
+    with pytest.raises(Exception):
+        list(m.generate(method="unknown", workers=2))
+
+    # Sparse spaces are split into a few chunks, not by the size of the space
+    s = "{{x | range(0, 2000)}} {{y | range(0, 2000) | equals('x')}}"
+    sparse = MadLibs({"s": s}, {})
+    expected = list(sparse.generate(shard=1, num_shards=3))
+    assert len(expected) == 666
+    assert list(sparse.generate(shard=1, num_shards=3, workers=2)) == expected
+
+
+def test_generate_indices():
+    s = (
+        '{{n | range(0, 8, 1) | less_than("m")}} and {{m | range(0, 8, 1)}} '
+        + "with {{person}}"
+    )
+    m = MadLibs({"s": s}, {"person": ["Jack", "Jill"]})
+    expected = list(m.generate())
+
+    for method in ["backtrack", "matrix"]:
+        indices = list(m.generate(method=method, output="indices"))
+        assert all(isinstance(t, tuple) for t in indices)
+        assert [m.decode(t) for t in indices] == expected
+
+        arrays = list(m.generate(method=method, output="arrays"))
+        rows = [tuple(row) for array in arrays for row in array.tolist()]
+        assert rows == indices
+        assert m.decode(arrays[0][0]) == expected[0]
+
+    shuffled = list(m.generate(order="shuffled", seed=5))
+    indices = list(m.generate(order="shuffled", seed=5, output="indices"))
+    assert [m.decode(t) for t in indices] == shuffled
+
+    indices = list(m.generate(output="indices"))
+    assert list(m.generate(output="indices", workers=2)) == indices
+    arrays = list(m.generate(output="arrays", workers=2))
+    assert [tuple(row) for array in arrays for row in array.tolist()] == indices
+
+    with pytest.raises(Exception):
+        list(m.generate(output="unknown"))
+
+    with pytest.raises(Exception):
+        list(m.generate(output="indices", dedup="memory"))
+
+
+def test_generate_shards():
+    s = (
+        '{{n | range(0, 10, 1) | less_than("m")}} and {{m | range(0, 10, 1)}} '
+        + "with {{person}}"
+    )
+    m = MadLibs({"s": s}, {"person": ["Jack", "Jill", "Jill", "Jack"]})
+    expected = list(m.generate())
+    for num_shards in [1, 2, 3, 7, 1000]:
+        shards = []
+        for shard in range(num_shards):
+            shards.extend(m.generate(shard=shard, num_shards=num_shards))
+        assert shards == expected
+
+    shuffled = list(m.generate(order="shuffled", seed=1))
+    shards = []
+    for shard in range(3):
+        shards.extend(m.generate(order="shuffled", seed=1, shard=shard, num_shards=3))
+    assert shards == shuffled
+
+    parallel = list(m.generate(shard=1, num_shards=2, workers=2))
+    assert parallel == list(m.generate(shard=1, num_shards=2))
+
+    with pytest.raises(Exception):
+        list(m.generate(shard=2, num_shards=2))
+
+    with pytest.raises(Exception):
+        list(m.generate(order="shuffled", shard=0, num_shards=2))
+
+
+def test_generation_order_is_stable():
+    script = (
+        "import json;"
+        + "from madlibs.utils import make_madlibs;"
+        + "m = make_madlibs('data/fillers.json', 'data/templates.json');"
+        + "print(json.dumps([list(g.generate()) for g in m.values()]))"
+    )
+    outputs = set()
+    for seed in ["0", "1", "2"]:
+        env = dict(os.environ, PYTHONHASHSEED=seed)
+        result = subprocess.run(
+            [sys.executable, "-c", script], env=env, capture_output=True, check=True
+        )
+        outputs.add(result.stdout)
+    assert len(outputs) == 1
+
+
+def test_from_file_lazy(tmp_path):
+    m = make_madlibs("data/fillers.json", "data/templates.json")
+    assert list(m) == ["group1", "group2"]
+    assert len(m) == 2
+    assert "group1" in m and "group3" not in m
+    assert len(m.groups) == 0
+
+    g = m["group1"]
+    assert m["group1"] is g
+    assert list(m.groups) == ["group1"]
+
+    with pytest.raises(KeyError):
+        m["group3"]
+
+    m.prebuild()
+    assert list(m.groups) == ["group1", "group2"]
+    first = m["group1"].templates.domains["person"]
+    second = m["group2"].templates.domains["person"]
+    assert first.values is second.values
+
+    cache_dir = str(tmp_path / "cache")
+    built = make_madlibs("data/fillers.json", "data/templates.json", cache_dir)
+    built.prebuild(workers=2)
+    assert list(built.groups) == ["group1", "group2"]
+    for name in built:
+        assert list(built[name].generate()) == list(m[name].generate())
+        assert os.path.exists(built.bundle_path(name))
+
+    # Groups from other processes and from bundles share values and a cache
+    loaded = make_madlibs("data/fillers.json", "data/templates.json", cache_dir)
+    for groups in [built, loaded]:
+        first = groups["group1"].templates
+        second = groups["group2"].templates
+        person = first.domains["person"].fillers
+        assert person is second.domains["person"].fillers
+        assert first.templates["sentence1"].domains["person"].fillers is person
+        assert first.templates["sentence1"].cache is second.templates["sentence2"].cache
+        assert list(groups["group1"].generate()) == list(m["group1"].generate())
+
+
+def test_generate_groups():
+    m = make_madlibs("data/fillers.json", "data/templates.json")
+    first = m["group1"].templates.signature()
+    assert first == m["group2"].templates.signature()
+
+    items = list(m.generate())
+    assert [name for name, _, _ in items[:4]] == ["group1", "group2"] * 2
+    for name in m:
+        expected = list(m[name].generate())
+        assert [(p, g) for n, p, g in items if n == name] == expected
+
+    shard = list(m.generate(["group2"], shard=1, num_shards=2))
+    expected = list(m["group2"].generate(shard=1, num_shards=2))
+    assert [(p, g) for _, p, g in shard] == expected
+
+    different = MadLibs({"s": "{{object}}"}, {"object": ["a", "b"]})
+    assert different.templates.signature() != first
+
+    # Groups built from separate fillers match by their values
+    same = MadLibs({"s": "{{object}}"}, {"object": ["a", "b"]})
+    assert same.templates.signature() == different.templates.signature()
+    other = MadLibs({"s": "{{object}}"}, {"object": ["b", "a"]})
+    assert other.templates.signature() != different.templates.signature()
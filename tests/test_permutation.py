@@ -0,0 +1,25 @@
+import pytest
+
+from madlibs.permutation import IndexPermutation
+
+
+def test_permutation():
+    for size in [0, 1, 2, 3, 10, 100, 1025]:
+        p = IndexPermutation(size, seed=7)
+        assert len(p) == size
+        assert sorted(p) == list(range(size))
+
+    assert list(IndexPermutation(100, seed=1)) == list(IndexPermutation(100, seed=1))
+    assert list(IndexPermutation(100, seed=1)) != list(IndexPermutation(100, seed=2))
+    assert list(IndexPermutation(100, seed=1)) != list(range(100))
+
+
+def test_large_permutation():
+    p = IndexPermutation(10**30, seed=3)
+    values = [p[i] for i in range(1000)]
+    assert len(set(values)) == 1000
+    for v in values:
+        assert 0 <= v < 10**30
+
+    with pytest.raises(IndexError):
+        p[10**30]
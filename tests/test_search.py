@@ -0,0 +1,148 @@
+import itertools
+
+import pytest
+
+from madlibs.group import MadLibTemplateGroup
+from madlibs.search import AssignmentSearch
+
+
+def brute_force(g):
+    independent = g.realize_independent_domains()
+    names = list(independent)
+    output = []
+    for values in itertools.product(*[independent[n] for n in names]):
+        fillers = g.realize_dependent_domains(dict(zip(names, values)))
+        if g.render(fillers) is not None:
+            output.append(fillers)
+    return output
+
+
+def test_search_matches_product():
+    templates = {
+        "s": "{{a | range(0, 6) | less_than('b')}} {{b | range(0, 6)}} "
+        + "{{c | range(0, 4) | not_equals('a') | greater_than('b')}}"
+    }
+    g = MadLibTemplateGroup(templates, {})
+    found = list(g.search().assignments())
+    assert found == brute_force(g)
+    assert len(found) > 0
+
+
+def test_search_with_dependents():
+    templates = {
+        "s": '{{name}} {{pronoun}} {{other | type("name") | not_equals("name")}}'
+    }
+    fillers = {
+        "person": [
+            {"name": "Jack", "pronoun": "he"},
+            {"name": "Jill", "pronoun": "she"},
+            {"name": "Joe", "pronoun": "he"},
+        ],
+    }
+    g = MadLibTemplateGroup(templates, fillers)
+    found = list(g.search().assignments())
+    assert found == brute_force(g)
+    assert len(found) == 6
+    for f in found:
+        assert f["name"] != f["other"]
+
+    search = g.search()
+    tuples = list(search.index_tuples())
+    assert all(isinstance(t, tuple) for t in tuples)
+    assert [search.decode(t) for t in tuples] == found
+    assert list(search.index_tuples(2, 7)) == [
+        t for t in tuples if 2 <= search.space.encode(list(t)) < 7
+    ]
+
+
+def test_search_prunes():
+    templates = {
+        "s": "{{a | type('digit') | greater_than('b')}} {{b | type('digit')}} "
+        + "{{c | range(0, 100)}}"
+    }
+    g = MadLibTemplateGroup(templates, {"digit": [str(i) for i in range(10)]})
+    independent = g.realize_independent_domains()
+    ordered = {v: independent[v] for v in ["a", "b", "c"]}
+    search = AssignmentSearch(ordered, g.domains, g.constraints)
+
+    # the constraint is checked as soon as both a and b are bound
+    assert len(search.checks[0]) == 0
+    assert len(search.checks[1]) == 1
+    assert len(search.checks[2]) == 0
+
+    calls = []
+    check = search.checks[1][0].check
+    search.checks[1][0].check = lambda f: calls.append(1) or check(f)
+    assert len(list(search.assignments())) == 45 * 100
+    assert len(calls) == 10 * 10
+
+
+def test_search_unknown_variable():
+    g = MadLibTemplateGroup({"s": "{{a | range(0, 3) | less_than('z')}}"}, {})
+    with pytest.raises(Exception):
+        g.search()
+
+
+def test_search_equality_lookups():
+    templates = {
+        "s": "{{a | range(0, 6)}} {{b | range(0, 6) | not_equals('a')}} "
+        + "{{c | range(0, 6) | not_equals('a') | not_equals('b')}} "
+        + "{{d | range(0, 12, 0.5) | equals('c')}} {{name}} "
+        + "{{e | type('name') | equals('name')}}"
+    }
+    fillers = {"person": [{"name": n} for n in ["1", "2.0", "x", "nan"]]}
+    g = MadLibTemplateGroup(templates, fillers)
+    search = g.search()
+    assert search.equal_to == [[], [], [], ["c"], [], ["name"]]
+    assert [sorted(names) for names in search.not_equal_to] == [
+        [],
+        ["a"],
+        ["a", "b"],
+        [],
+        [],
+        [],
+    ]
+    assert all(len(checks) == 0 for checks in search.residual_checks)
+
+    found = list(search.assignments())
+    assert found == brute_force(g)
+    assert len(found) == 6 * 5 * 4 * 3
+    assert list(search.assignments(100, 2000)) == [
+        f for f in found if 100 <= search.space.encode(search.digits(f)) < 2000
+    ]
+
+
+def test_search_range_bounds():
+    templates = {
+        "s": "{{name}} {{a | range(0, 8)}} {{b | range(0, 4, 0.5) | greater_than('a')}} "
+        + "{{c | range(-2, 9) | less_than('a') | greater_than('name')}} "
+        + "{{d | range(0, 3) | not_equals('c')}}"
+    }
+    fillers = {"person": [{"name": n} for n in ["-1", "0.5", "nan", "4"]]}
+    g = MadLibTemplateGroup(templates, fillers)
+    search = g.search()
+    assert search.greater_than == [[], [], ["a"], ["name"], []]
+    assert search.less_than == [[], [], [], ["a"], []]
+    assert all(len(checks) == 0 for checks in search.residual_checks)
+
+    found = list(search.assignments())
+    assert found == brute_force(g)
+    assert len(found) > 0
+    assert [search.decode(t) for t in search.index_tuples()] == found
+
+    # Only the values between the bounds are visited
+    g = MadLibTemplateGroup(
+        {"s": "{{a | range(0, 1000000) | greater_than('b')}} {{b | range(0, 3)}}"},
+        {},
+    )
+    search = AssignmentSearch(
+        {v: g.realize_independent_domains()[v] for v in ["b", "a"]},
+        g.domains,
+        g.constraints,
+    )
+    assert len(search.values[1]) == 1000000
+    found = list(search.assignments(999990, 1000010))
+    assert found == [{"b": "0", "a": str(i)} for i in range(999990, 1000000)] + [
+        {"b": "1", "a": str(i)} for i in range(2, 10)
+    ]
+    assert search.digits({"a": "999999", "b": "2"}) == [2, 999999]
@@ -0,0 +1,46 @@
+import itertools
+
+import pytest
+
+from madlibs.space import ProductSpace
+
+
+def test_product_space():
+    space = ProductSpace([2, 3, 4])
+    assert len(space) == 24
+
+    expected = list(itertools.product(range(2), range(3), range(4)))
+    for index, digits in enumerate(expected):
+        assert space.decode(index) == list(digits)
+        assert space.encode(list(digits)) == index
+
+    with pytest.raises(IndexError):
+        space.decode(24)
+
+    with pytest.raises(IndexError):
+        space.decode(-1)
+
+    with pytest.raises(IndexError):
+        space.encode([0, 3, 0])
+
+    with pytest.raises(IndexError):
+        space.encode([0, 0])
+
+
+def test_empty_product_space():
+    space = ProductSpace([])
+    assert len(space) == 1
+    assert space.decode(0) == []
+    assert space.encode([]) == 0
+
+    space = ProductSpace([3, 0])
+    assert len(space) == 0
+    with pytest.raises(IndexError):
+        space.decode(0)
+
+
+def test_large_product_space():
+    space = ProductSpace([1000] * 10)
+    assert space.size == 10**30
+    digits = [7] * 10
+    assert space.decode(space.encode(digits)) == digits
@@ -1,5 +1,6 @@
 import pytest
 
+from madlibs.compiled import TemplateCache
 from madlibs.template import MadLibTemplate
 
 
@@ -272,3 +273,45 @@ def test_multiple_dependents():
     m = MadLibTemplate(template, fillers)
     generated = m.render({"name": "Jack", "pronoun": "he", "noun": "man"})
     assert generated == "Jack he man he"
+
+
+def test_template_compiled():
+    fillers = {
+        "item": ["book & pen", "<page>"],
+        "location": ["table", "chair"],
+    }
+    templates = [
+        "The {{item}} is on the {{location}}.",
+        "{{item | title}} on {{location | upper}}",
+        '{{item | type("item") | truncate(6, True, "")}}{{location}}',
+        '{{n | range(0, 3, 1) | less_than("m")}} < {{m | range(0, 3, 1)}}\n',
+        '{{item | replace("b", "c")}} {{location}}',
+        "{{location | center(9)}}",
+    ]
+    for template in templates:
+        m = MadLibTemplate(template, fillers)
+        for item in fillers["item"]:
+            params = {"item": item, "location": "table", "n": "0", "m": "1"}
+            assert m.render(params) == m.template.render(**params)
+
+    assert MadLibTemplate(templates[1], fillers).compiled is not None
+    assert MadLibTemplate(templates[3], fillers).compiled is not None
+
+    # replace needs Jinja's evaluation context, so it is rendered by Jinja
+    assert MadLibTemplate(templates[4], fillers).compiled is None
+
+
+def test_template_cache():
+    fillers = {"item": ["book", "page"], "location": ["table", "chair"]}
+    cache = TemplateCache()
+    first = MadLibTemplate("The {{item}} is on the {{location}}.", fillers, None, cache)
+    second = MadLibTemplate(
+        "The {{item}} is on the {{location}}.", fillers, None, cache
+    )
+    assert len(cache.asts) == 1
+    assert first.compiled is second.compiled
+
+    # The Jinja template is only compiled when it is needed
+    assert len(cache.templates) == 0
+    assert first.template is second.template
+    assert len(cache.templates) == 1
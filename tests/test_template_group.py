@@ -69,3 +69,132 @@ def test_template_group_missing_filler_exception():
 
     with pytest.raises(Exception):
         g.render({"name": "Jack", "food": "roti"})
+
+
+def test_template_group_variable_order():
+    templates = {
+        "a": "{{food}} was eaten by {{name}}.",
+        "b": "{{pronoun | title}} ate {{drink}} and {{food}}.",
+    }
+
+    fillers = {
+        "person": [
+            {"name": "Jack", "pronoun": "he"},
+            {"name": "Jill", "pronoun": "she"},
+        ],
+        "food": ["lasagna", "roti"],
+        "drink": ["tea", "coffee"],
+    }
+
+    g = MadLibTemplateGroup(templates, fillers)
+    assert g.variable_order == ["food", "name", "pronoun", "drink"]
+    assert g.templates["b"].variable_order == ["pronoun", "drink", "food"]
+    assert list(g.realize_independent_domains()) == ["food", "name", "drink"]
+
+
+def test_realize_dependent_domains():
+    templates = {"a": "{{name}} ({{pronoun}}, {{city}}) ate {{food}}."}
+    fillers = {
+        "person": [
+            {"name": "Jack", "pronoun": "he", "city": "Paris"},
+            {"name": "Jill", "pronoun": "she", "city": "Rome"},
+        ],
+        "food": ["lasagna", "roti"],
+    }
+    g = MadLibTemplateGroup(templates, fillers)
+    search = g.search()
+    assert search.tables[0] == [
+        {"name": "Jack", "pronoun": "he", "city": "Paris"},
+        {"name": "Jill", "pronoun": "she", "city": "Rome"},
+    ]
+    assert search.tables[1] is None
+
+    realized = g.realize_dependent_domains({"name": "Jill", "food": "roti"})
+    assert realized == {
+        "name": "Jill",
+        "food": "roti",
+        "pronoun": "she",
+        "city": "Rome",
+    }
+
+
+def test_render_memoized():
+    templates = {"s1": "{{person}} is here.", "s2": "{{person}} likes {{object}}."}
+    fillers = {"person": ["Jack", "Jill"], "object": ["cake", "tea", "pie"]}
+    g = MadLibTemplateGroup(templates, fillers)
+
+    calls = {"s1": 0, "s2": 0}
+    for name, t in g.templates.items():
+        render = t.render
+
+        def counted(f, name=name, render=render):
+            calls[name] += 1
+            return render(f)
+
+        t.render = counted
+
+    assert g.memoized == {"s1"}
+    items = [g.render_assignment(f) for f in g.search().assignments()]
+    assert len(items) == 6
+    assert calls == {"s1": 2, "s2": 6}
+    for params, generated in items:
+        assert generated["s1"] == f"{params['person']} is here."
+
+
+def test_memoized_templates():
+    templates = {
+        "a": "{{name}} ate {{food}}.",
+        "b": "{{pronoun}} ate {{food}}.",
+        "c": "{{pronoun}} was hungry.",
+    }
+    fillers = {
+        "person": [
+            {"name": "Jack", "pronoun": "he"},
+            {"name": "Jill", "pronoun": "she"},
+        ],
+        "food": ["lasagna", "roti"],
+    }
+    g = MadLibTemplateGroup(templates, fillers)
+    # b reads the name through the pronoun, so only c misses an independent variable
+    assert g.memoized == {"c"}
+    for f in g.search().assignments():
+        assert g.render_assignment(f)[1]["c"] == f"{f['pronoun']} was hungry."
+
+
+def test_constraints_use_parsed_values():
+    templates = {
+        "s": "{{a | type('age') | less_than('b')}} {{b | range(0, 50)}} "
+        + "{{c | type('name') | not_equals('a')}}"
+    }
+    fillers = {"age": ["10", "20", "30.5"], "name": ["Jack", "20"]}
+    g = MadLibTemplateGroup(templates, fillers)
+    less_than = g.constraints["a"][0]
+    assert g.domains["a"].value_type == "number"
+    assert g.domains["c"].value_type == "string"
+    assert less_than.parse == g.domains["a"].fillers.numbers.__getitem__
+    assert less_than.other_parse is float
+
+    found = list(g.search().assignments())
+    assert len(found) == 39 * 2 + 29 * 1 + 19 * 2
+    assert all(float(f["a"]) < float(f["b"]) and f["a"] != f["c"] for f in found)
+
+    # Dependents are parsed from the column of their parent
+    templates = {
+        "s": "{{name}} {{pronoun | not_equals('other')}} {{other | type('word')}} "
+        + "{{age | less_than('n')}} {{n | range(0, 40)}}"
+    }
+    fillers = {
+        "person": [
+            {"name": "Jack", "pronoun": "he", "age": "30"},
+            {"name": "Jill", "pronoun": "she", "age": "20"},
+        ],
+        "word": ["he", "Joe"],
+    }
+    g = MadLibTemplateGroup(templates, fillers)
+    person = g.domains["name"].fillers
+    not_equals = g.constraints["pronoun"][0]
+    less_than = g.constraints["age"][0]
+    assert not_equals.parse == person.column_keys["pronoun"].__getitem__
+    assert less_than.parse == person.column_numbers["age"].__getitem__
+    assert "pronoun" not in person.column_numbers
+    assert len(list(g.search().assignments())) == 9 + 19 * 2